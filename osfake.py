@@ -0,0 +1,525 @@
+import BaseHTTPServer
+import SocketServer
+import argparse
+import collections
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib
+import urlparse
+
+import prettytable
+
+import osinventory
+
+PROJECT = 'fakeproject'
+REGION = 'fake'
+
+# Sizes of the synthetic tenants of the benchmark
+BENCH_SIZES = [100, 10000, 100000]
+
+# Runs of osinventory timed by the import benchmark: label, arguments, with credentials
+IMPORT_RUNS = [('import', None, False),
+               ('--help', ['--help'], False),
+               ('missing credentials', ['-u', 'fakeuser'], False),
+               ('--only keypairs', ['--only', 'keypairs'], True),
+               ('all resources', [], True)]
+
+# Run in a new interpreter, so that no library is already imported
+IMPORT_PROBE = '''
+import json, os, sys, time
+started = time.time()
+argv = json.loads(sys.argv[1])
+import osinventory
+imported = time.time()
+if argv is not None:
+    sys.argv = ['osinventory.py'] + argv
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        osinventory.main()
+    except SystemExit:
+        pass
+json.dump({'import': imported - started, 'total': time.time() - started,
+           'libraries': sorted(service for service, module in osinventory.CLIENT_MODULES.items()
+                               if module in sys.modules)}, sys.__stdout__)
+'''
+
+
+def uuid(prefix, i):
+    return '%08x-0000-4000-8000-%012x' % (prefix, i)
+
+
+class Tenant(object):
+    """Synthetic project with `size` servers, volumes and images"""
+
+    def __init__(self, size):
+        self.flavors = [{'id': str(i), 'name': 'flavor%d' % i, 'vcpus': 2 ** i,
+                         'ram': 1024 * 2 ** i, 'disk': 20 * 2 ** i} for i in range(4)]
+        self.images = [{'id': uuid(1, i), 'name': 'image%d' % i, 'status': 'active',
+                        'size': 1024 ** 3, 'disk_format': 'qcow2', 'container_format': 'bare',
+                        'created_at': '2016-01-01T00:00:00', 'updated_at': '2016-01-01T00:00:00',
+                        'deleted': False, 'is_public': i % 2 == 0,
+                        'owner': PROJECT if i % 4 == 1 else 'other',
+                        'properties': {'cw_origin': 'Cloudwatt'} if i % 4 == 0 else
+                        {'image_type': 'snapshot'} if i % 4 == 1 else {}}
+                       for i in range(size)]
+        self.servers = [{'id': uuid(2, i), 'name': 'server%d' % i, 'status': 'SHUTOFF' if i % 5 == 4 else 'ACTIVE',
+                         'addresses': {'private': [{'addr': '10.%d.%d.%d' % (i >> 16, (i >> 8) % 256, i % 256),
+                                                    'OS-EXT-IPS:type': 'fixed', 'version': 4}]},
+                         'flavor': {'id': str(i % 4)}, 'image': {'id': uuid(1, i)},
+                         'key_name': 'key', 'metadata': {}, 'tenant_id': PROJECT,
+                         'updated': '2016-%02d-01T00:00:00Z' % (i % 12 + 1),
+                         'created': '2016-%02d-01T00:00:00Z' % (i % 12 + 1)}
+                        for i in range(size)]
+        self.volumes = [{'id': uuid(3, i), 'name': 'volume%d' % i, 'status': 'in-use' if i % 2 else 'available',
+                         'size': 10, 'volume_type': 'standard', 'bootable': 'false', 'snapshot_id': None,
+                         'created_at': '2016-01-01T00:00:00', 'metadata': {},
+                         'attachments': [{'server_id': uuid(2, i), 'device': '/dev/vdb'}] if i % 2 else []}
+                        for i in range(size)]
+        self.snapshots = [{'id': uuid(4, i), 'name': 'snapshot%d' % i, 'status': 'available',
+                           'description': '', 'size': 10, 'volume_id': uuid(3, i),
+                           'created_at': '2016-01-01T00:00:00', 'metadata': {},
+                           'os-extended-snapshot-attributes:progress': '100%',
+                           'os-extended-snapshot-attributes:project_id': PROJECT} for i in range(size / 10)]
+        self.snapshot_summaries = [dict((key, value) for key, value in snapshot.items()
+                                        if not key.startswith('os-extended-snapshot-attributes:'))
+                                   for snapshot in self.snapshots]
+        self.backups = []
+        # Networks and subnets have the attributes of the API, most of them not inventoried
+        self.networks = [{'id': uuid(5, i), 'name': 'network%d' % i, 'status': 'ACTIVE',
+                          'subnets': [uuid(6, i)], 'router:external': i == 0, 'tenant_id': PROJECT,
+                          'admin_state_up': True, 'shared': False, 'mtu': 1450, 'description': '',
+                          'availability_zones': ['nova'], 'port_security_enabled': True}
+                         for i in range(max(3, size / 10))]
+        self.subnets = [{'id': uuid(6, i), 'name': 'subnet%d' % i, 'network_id': uuid(5, i),
+                         'allocation_pools': [], 'gateway_ip': '10.%d.%d.1' % (i / 256, i % 256),
+                         'cidr': '10.%d.%d.0/24' % (i / 256, i % 256), 'tenant_id': PROJECT, 'ip_version': 4,
+                         'enable_dhcp': True, 'dns_nameservers': ['185.23.94.244', '185.23.94.245'],
+                         'host_routes': [], 'ipv6_ra_mode': None, 'ipv6_address_mode': None,
+                         'subnetpool_id': None, 'description': ''}
+                        for i in range(max(3, size / 10))]
+        self.routers = [{'id': uuid(7, 0), 'name': 'router', 'status': 'ACTIVE',
+                         'external_gateway_info': {'network_id': uuid(5, 0)}}]
+        self.pools = [{'id': uuid(8, i), 'name': 'pool%d' % i, 'status': 'ACTIVE', 'provider': 'haproxy',
+                       'lb_method': 'ROUND_ROBIN', 'admin_state_up': True, 'protocol': 'HTTP'}
+                      for i in range(3)]
+        self.members = [{'id': uuid(9, i), 'pool_id': uuid(8, i % 3), 'status': 'ACTIVE',
+                         'address': '10.0.0.%d' % i, 'protocol_port': 80} for i in range(9)]
+        self.loadbalancers = [{'id': uuid(13, i), 'name': 'lb%d' % i, 'vip_address': '10.0.1.%d' % i,
+                               'provisioning_status': 'ACTIVE', 'operating_status': 'ONLINE',
+                               'provider': 'haproxy'} for i in range(2)]
+        self.listeners = [{'id': uuid(14, i), 'name': 'listener%d' % i, 'protocol': 'HTTP', 'protocol_port': 80,
+                           'loadbalancers': [{'id': uuid(13, i)}], 'default_pool_id': uuid(15, i)}
+                          for i in range(2)]
+        self.healthmonitors = [{'id': uuid(16, 0), 'type': 'HTTP', 'delay': 5, 'timeout': 3, 'max_retries': 3,
+                                'url_path': '/health', 'pools': [{'id': uuid(15, 0)}]}]
+        self.lbaas_members = dict((uuid(15, i), [{'id': uuid(17, 3 * i + j), 'address': '10.0.0.%d' % (3 * i + j),
+                                                  'protocol_port': 8080, 'weight': 1, 'operating_status': 'ONLINE',
+                                                  'admin_state_up': True} for j in range(3)])
+                                  for i in range(2))
+        self.lbaas_pools = [{'id': uuid(15, i), 'name': 'v2pool%d' % i, 'protocol': 'HTTP',
+                             'lb_algorithm': 'ROUND_ROBIN', 'admin_state_up': True,
+                             'loadbalancers': [{'id': uuid(13, i)}], 'listeners': [{'id': uuid(14, i)}],
+                             'healthmonitor_id': uuid(16, 0) if i == 0 else None,
+                             'members': [{'id': member['id']} for member in self.lbaas_members[uuid(15, i)]]}
+                            for i in range(2)]
+        self.stacks = [{'id': uuid(10, i), 'stack_name': 'stack%d' % i, 'creation_time': '2016-01-01T00:00:00',
+                        'stack_status': 'CREATE_COMPLETE', 'stack_status_reason': '', 'links': []}
+                       for i in range(5)]
+        # Each stack has a server, a volume and a network, and the even ones a nested stack with a
+        # server. Nested stack 0 also has nested stack 1, the one of stack 2, to be visited once.
+        self.nested_stacks = [{'id': uuid(18, i), 'stack_name': 'stack%d-nested' % (2 * i),
+                               'creation_time': '2016-01-01T00:00:00', 'stack_status': 'CREATE_COMPLETE',
+                               'stack_status_reason': '', 'parent': uuid(10, 2 * i), 'links': []}
+                              for i in range(3)]
+        self.stack_details = dict((stack['id'], dict(stack, outputs=[
+            {'output_key': 'url', 'output_value': 'http://%s/' % stack['stack_name'], 'description': 'Site'}]))
+            for stack in self.stacks + self.nested_stacks)
+
+        def resource(stack, name, resource_type, physical_id, nested=None):
+            links = [{'rel': 'self', 'href': '%s/stacks/%s/%s/resources/%s' % (PROJECT, stack['stack_name'],
+                                                                               stack['id'], name)}]
+            if nested:
+                links.append({'rel': 'nested', 'href': '%s/stacks/%s/%s' % (PROJECT, nested['stack_name'],
+                                                                            nested['id'])})
+            return {'resource_name': name, 'resource_type': resource_type, 'physical_resource_id': physical_id,
+                    'resource_status': 'CREATE_COMPLETE', 'links': links}
+
+        self.stack_resources = {}
+        for i, stack in enumerate(self.stacks):
+            self.stack_resources[stack['id']] = [
+                resource(stack, 'server', 'OS::Nova::Server', uuid(2, i % size)),
+                resource(stack, 'volume', 'OS::Cinder::Volume', uuid(3, i % size)),
+                resource(stack, 'network', 'OS::Neutron::Net', uuid(5, i % len(self.networks)))]
+            if i % 2 == 0:
+                nested = self.nested_stacks[i / 2 % 3]
+                self.stack_resources[stack['id']].append(resource(stack, 'group', 'OS::Heat::ResourceGroup',
+                                                                  nested['id'], nested))
+        for i, stack in enumerate(self.nested_stacks):
+            self.stack_resources[stack['id']] = [resource(stack, '0', 'OS::Nova::Server', uuid(2, (5 + i) % size))]
+        self.stack_resources[uuid(18, 0)].append(resource(self.nested_stacks[0], 'nested', 'OS::Heat::Stack',
+                                                          uuid(18, 1), self.nested_stacks[1]))
+        self.servers_by_id = dict((server['id'], server) for server in self.servers)
+        self.limits = {'maxTotalInstances': size, 'totalInstancesUsed': size,
+                       'maxTotalRAMSize': 1024 * size, 'totalRAMUsed': 1024 * size,
+                       'maxTotalCores': 2 * size, 'totalCoresUsed': 2 * size,
+                       'maxTotalVolumes': size, 'totalVolumesUsed': size,
+                       'maxTotalSnapshots': size, 'totalSnapshotsUsed': size / 10,
+                       'maxTotalBackups': size, 'totalBackupsUsed': 0,
+                       'maxTotalVolumeGigabytes': 10 * size, 'totalGigabytesUsed': 10 * size,
+                       'maxTotalBackupGigabytes': 10 * size,
+                       'totalBackupGigabytesUsed': 0}
+
+
+def filter_rows(rows, query):
+    """Return the rows matching the filters of query supported by the APIs
+
+    Names are regular expressions for nova, as for the other APIs they are
+    matched exactly. changes-since compares to the update time.
+    """
+    for parameter, values in query.items():
+        value = values[0]
+        if parameter == 'status':
+            rows = [row for row in rows if row.get('status', '').lower() == value.lower()]
+        elif parameter == 'name':
+            rows = [row for row in rows if (re.search(value, row['name']) if 'created' in row
+                                            else row['name'] == value)]
+        elif parameter == 'changes-since':
+            rows = [row for row in rows if (row.get('updated') or row.get('updated_at')) >= value]
+        elif parameter == 'is_public':
+            rows = [row for row in rows if row.get('is_public') == (value.lower() == 'true')]
+    return rows
+
+
+def project_rows(rows, query):
+    """Return the rows with the fields of query only, as neutron does"""
+    if 'fields' not in query:
+        return rows
+    return [dict((field, row[field]) for field in query['fields'] if field in row) for row in rows]
+
+
+def paginate(rows, query):
+    """Return the page of rows selected by the limit and marker of query"""
+    limit = int(query.get('limit', [1000])[0])
+    marker = query.get('marker', [None])[0]
+    start = 0
+    if marker:
+        start = next((i + 1 for i, row in enumerate(rows) if row['id'] == marker), len(rows))
+    return rows[start:start + limit], limit
+
+
+class FakeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body, content_type='application/json'):
+        if not isinstance(body, basestring):
+            body = json.dumps(body)
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type or 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.reply(*self.server.respond('GET', self.path, ''))
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.reply(*self.server.respond('POST', self.path, body))
+
+
+class FakeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, latency=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), FakeHandler)
+        self.latency = latency
+        self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+class SyntheticServer(FakeServer):
+    """Serve a synthetic tenant through the APIs used by osinventory"""
+
+    def __init__(self, tenant, port=0, latency=0):
+        FakeServer.__init__(self, port, latency)
+        self.tenant = tenant
+        self.auth_url = self.url + '/identity/v2.0'
+
+    def catalog(self):
+        endpoints = [('compute', '/compute/v2.1/' + PROJECT), ('volumev2', '/volume/v2/' + PROJECT),
+                     ('image', '/image'), ('network', '/network'),
+                     ('orchestration', '/orchestration/v1/' + PROJECT), ('identity', '/identity/v2.0')]
+        return [{'type': service_type, 'name': service_type,
+                 'endpoints': [{'region': REGION, 'publicURL': self.url + path,
+                                'internalURL': self.url + path, 'adminURL': self.url + path}]}
+                for service_type, path in endpoints]
+
+    def respond(self, method, path, body):
+        url = urlparse.urlparse(path)
+        query = urlparse.parse_qs(url.query)
+        path = url.path.replace('.json', '').rstrip('/')
+        tenant = self.tenant
+        if method == 'POST' and path.endswith('/tokens'):
+            return 200, {'access': {'token': {'id': 'faketoken', 'expires': '2099-01-01T00:00:00Z',
+                                              'tenant': {'id': PROJECT, 'name': PROJECT}},
+                                    'serviceCatalog': self.catalog(),
+                                    'user': {'id': 'fakeuser', 'name': 'fakeuser', 'roles': []}}}
+        if path.endswith('/limits'):
+            return 200, {'limits': {'absolute': tenant.limits, 'rate': []}}
+
+        listings = {'/compute/v2.1/%s/servers/detail' % PROJECT: ('servers', tenant.servers),
+                    '/compute/v2.1/%s/flavors/detail' % PROJECT: ('flavors', tenant.flavors),
+                    '/volume/v2/%s/volumes/detail' % PROJECT: ('volumes', tenant.volumes),
+                    '/volume/v2/%s/volumes' % PROJECT: ('volumes', tenant.volumes),
+                    '/volume/v2/%s/snapshots/detail' % PROJECT: ('snapshots', tenant.snapshots),
+                    '/volume/v2/%s/snapshots' % PROJECT: ('snapshots', tenant.snapshot_summaries),
+                    '/volume/v2/%s/backups/detail' % PROJECT: ('backups', tenant.backups),
+                    '/image/v1/images/detail': ('images', tenant.images),
+                    '/network/v2.0/networks': ('networks', tenant.networks),
+                    '/network/v2.0/subnets': ('subnets', tenant.subnets),
+                    '/network/v2.0/routers': ('routers', tenant.routers),
+                    '/network/v2.0/lb/pools': ('pools', tenant.pools),
+                    '/network/v2.0/lb/members': ('members', tenant.members),
+                    '/network/v2.0/lbaas/loadbalancers': ('loadbalancers', tenant.loadbalancers),
+                    '/network/v2.0/lbaas/listeners': ('listeners', tenant.listeners),
+                    '/network/v2.0/lbaas/pools': ('pools', tenant.lbaas_pools),
+                    '/network/v2.0/lbaas/healthmonitors': ('healthmonitors', tenant.healthmonitors),
+                    '/orchestration/v1/%s/stacks' % PROJECT: ('stacks', tenant.stacks)}
+        if path in listings:
+            key, rows = listings[path]
+            page, limit = paginate(filter_rows(rows, query), query)
+            body = {key: project_rows(page, query)}
+            if path.startswith('/network') and len(page) == limit:
+                next_query = dict(query, marker=[page[-1]['id']])
+                body[key + '_links'] = [{'rel': 'next', 'href': '%s%s?%s' % (
+                    self.url, url.path, urllib.urlencode(next_query, doseq=True))}]
+            return 200, body
+
+        if path == '/network/v2.0/extensions':
+            return 200, {'extensions': [{'alias': alias, 'name': alias} for alias in ('lbaas', 'lbaasv2')]}
+        if path.startswith('/network/v2.0/lbaas/pools/') and path.endswith('/members'):
+            page, limit = paginate(tenant.lbaas_members.get(path.split('/')[-2], []), query)
+            return 200, {'members': project_rows(page, query)}
+
+        stacks = '/orchestration/v1/%s/stacks/' % PROJECT
+        if path.startswith(stacks):
+            # /stacks/<id>[/resources] or /stacks/<name>/<id>[/resources]
+            segments = path[len(stacks):].split('/')
+            resources = segments[-1] == 'resources'
+            stack_id = segments[-2] if resources else segments[-1]
+            if stack_id not in tenant.stack_details:
+                return 404, {'error': {'code': 404, 'message': 'The Stack (%s) could not be found.' % stack_id}}
+            if resources:
+                return 200, {'resources': tenant.stack_resources[stack_id]}
+            return 200, {'stack': tenant.stack_details[stack_id]}
+
+        compute = '/compute/v2.1/%s/' % PROJECT
+        if path.startswith(compute + 'servers/'):
+            server = tenant.servers_by_id.get(path.rsplit('/', 1)[1])
+            if server is None:
+                return 404, {'itemNotFound': {'code': 404, 'message': 'Instance could not be found'}}
+            return 200, {'server': server}
+        if path == compute + 'os-floating-ips':
+            return 200, {'floating_ips': [{'id': uuid(11, 0), 'ip': '192.0.2.1', 'fixed_ip': None,
+                                           'instance_id': None, 'pool': 'public'}]}
+        if path == compute + 'os-security-groups':
+            return 200, {'security_groups': [{'id': uuid(12, 0), 'name': 'default', 'description': 'default',
+                                              'rules': [{'ip_protocol': 'tcp', 'from_port': 22, 'to_port': 22,
+                                                         'ip_range': {'cidr': '0.0.0.0/0'}}]}]}
+        if path == compute + 'os-keypairs':
+            return 200, {'keypairs': [{'keypair': {'name': 'key', 'fingerprint': 'aa:bb:cc'}}]}
+        return 404, {'error': {'code': 404, 'message': 'Not found: %s %s' % (method, path)}}
+
+
+class ReplayServer(FakeServer):
+    """Replay the API responses of a fixture recorded with osinventory.py --record
+
+    The endpoints of the recorded cloud are served under the path of their
+    host, e.g. https://compute.example.com:8774/v2.1 is served at
+    <url>/compute.example.com:8774/v2.1. Responses to the same request are
+    replayed in order, the last one being repeated.
+    """
+
+    def __init__(self, fixture, port=0, latency=0):
+        FakeServer.__init__(self, port, latency)
+        self.responses = collections.defaultdict(list)
+        self.served = collections.Counter()
+        self.lock = threading.Lock()
+        self.hosts = set()
+        with open(fixture) as f:
+            for line in f:
+                record = json.loads(line)
+                url = urlparse.urlparse(record['url'])
+                self.hosts.add('%s://%s' % (url.scheme, url.netloc))
+                self.responses[self.key(record['method'], url.netloc, url.path, url.query)].append(record)
+        self.auth_urls = sorted(set(self.rewrite(r['url']).rsplit('/tokens', 1)[0]
+                                    for records in self.responses.values() for r in records
+                                    if r['method'] == 'POST' and r['url'].endswith('/tokens')))
+
+    def key(self, method, netloc, path, query):
+        return method, netloc + path.rstrip('/'), tuple(sorted(urlparse.parse_qsl(query)))
+
+    def rewrite(self, text):
+        """Point the URLs of the recorded cloud to this server"""
+        for host in self.hosts:
+            text = text.replace(host, self.url + '/' + host.split('://', 1)[1])
+        return text
+
+    def respond(self, method, path, body):
+        url = urlparse.urlparse(path)
+        netloc, _, path = url.path.lstrip('/').partition('/')
+        key = self.key(method, netloc, '/' + path, url.query)
+        with self.lock:
+            records = self.responses.get(key)
+            if not records:
+                return 404, {'error': {'code': 404, 'message': 'Not recorded: %s %s' % (method, url.path)}}
+            record = records[min(self.served[key], len(records) - 1)]
+            self.served[key] += 1
+        body = record['body']
+        if method == 'POST' and path.endswith('/tokens') and record['status'] == 200:
+            # A recorded token may have expired, which would make the client authenticate again
+            access = json.loads(body)
+            access['access']['token']['expires'] = '2099-01-01T00:00:00Z'
+            body = json.dumps(access)
+        return record['status'], self.rewrite(body), record['content_type']
+
+
+def received(utility):
+    """Return the KB received by the API calls of an inventory"""
+    return sum(call['bytes'] for call in utility.profiler.calls) / 1024
+
+
+def bench(sizes, latency, out=sys.stdout):
+    """Time OpenStackUtils construction and print_ressources on synthetic tenants
+
+    The KB received are compared with those of an inventory downloading
+    the whole rows, which are never less.
+    """
+    table = prettytable.PrettyTable(['Size', 'Construction (s)', 'print_ressources (s)', 'Total (s)',
+                                     'KB received', 'KB without projection'])
+    with open(os.devnull, 'w') as devnull:
+        for size in sizes:
+            server = SyntheticServer(Tenant(size), latency=latency)
+            server.start()
+            config = {'username': 'fakeuser', 'password': 'fakepassword', 'project': PROJECT,
+                      'auth_url': server.auth_url, 'region_name': REGION, 'file': None, 'cache': False,
+                      'profile': True}
+            started = time.time()
+            utility = osinventory.OpenStackUtils(config)
+            constructed = time.time()
+            utility.print_ressources(devnull)
+            rendered = time.time()
+            unprojected = osinventory.OpenStackUtils(dict(config, projection=False))
+            # Read all the listings, as rendering the inventory would
+            unprojected.inventory.load()
+            server.shutdown()
+            server.server_close()
+            table.add_row([size, '%.3f' % (constructed - started), '%.3f' % (rendered - constructed),
+                           '%.3f' % (rendered - started), received(utility), received(unprojected)])
+            if received(unprojected) < received(utility):
+                print >>out, 'size %d: less received without projection, the inventories differ' % size
+            print >>out, 'size %d done in %.3f seconds' % (size, rendered - started)
+    print >>out, table
+
+
+def import_probe(argv):
+    """Run osinventory with argv, or only import it if None, in a new interpreter without OS_ variables
+
+    Return the import and total times and the client libraries imported.
+    """
+    env = dict((name, value) for name, value in os.environ.items() if not name.startswith('OS_'))
+    with open(os.devnull, 'w') as devnull:
+        probe = subprocess.Popen([sys.executable, '-c', IMPORT_PROBE, json.dumps(argv)],
+                                 cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                                 stdout=subprocess.PIPE, stderr=devnull)
+        return json.loads(probe.communicate()[0])
+
+
+def imports(out=sys.stdout):
+    """Time the import of osinventory and short runs, listing the client libraries they import"""
+    table = prettytable.PrettyTable(['Run', 'Import (s)', 'Total (s)', 'Client libraries'])
+    server = SyntheticServer(Tenant(10))
+    server.start()
+    credentials = ['-u', 'fakeuser', '-pwd', 'fakepassword', '-p', PROJECT, '-url', server.auth_url,
+                   '-r', REGION, '--no-cache']
+    for label, argv, authenticated in IMPORT_RUNS:
+        if authenticated:
+            argv = credentials + argv
+        result = import_probe(argv)
+        table.add_row([label, '%.3f' % result['import'], '%.3f' % result['total'],
+                       ', '.join(result['libraries']) or '-'])
+    server.shutdown()
+    server.server_close()
+    print >>out, table
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the OpenStack APIs '
+                                     'used by osinventory')
+    subparsers = parser.add_subparsers(dest='command')
+    replay = subparsers.add_parser('replay', help='replay a fixture recorded with '
+                                   'osinventory.py --record')
+    replay.add_argument('fixture', help='fixture file')
+    synth = subparsers.add_parser('synth', help='serve a synthetic project')
+    synth.add_argument('--size', help='number of servers, volumes and images',
+                       type=int, default=100)
+    for subparser in (replay, synth):
+        subparser.add_argument('--port', help='port to listen on',
+                               type=int, default=5000)
+    benchmark = subparsers.add_parser('bench', help='time osinventory against synthetic '
+                                      'projects of several sizes')
+    benchmark.add_argument('--sizes', help='comma separated numbers of servers, volumes and images',
+                           default=','.join(str(size) for size in BENCH_SIZES))
+    for subparser in (replay, synth, benchmark):
+        subparser.add_argument('--latency', help='milliseconds added to each response',
+                               type=float, default=0)
+    subparsers.add_parser('imports', help='time the import of osinventory and the client '
+                          'libraries imported by short runs')
+    args = parser.parse_args()
+
+    if args.command == 'imports':
+        imports()
+        return
+
+    if args.command == 'bench':
+        bench([int(size) for size in args.sizes.split(',')], args.latency / 1000.0)
+        return
+
+    if args.command == 'replay':
+        server = ReplayServer(args.fixture, args.port, args.latency / 1000.0)
+        auth_urls = server.auth_urls
+    else:
+        server = SyntheticServer(Tenant(args.size), args.port, args.latency / 1000.0)
+        auth_urls = [server.auth_url]
+    print 'Serving on %s, use:' % server.url
+    for auth_url in auth_urls:
+        print '    python osinventory.py --no-cache -url %s -u <username> -pwd <password> ' \
+              '-p <project> -r <region>' % auth_url
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,250 @@
+import BaseHTTPServer
 import argparse
+import collections
+import email.utils
+import functools
+import hashlib
+import importlib
+import json
 import logging
 import os
+import random
+import re
 import sys
 import prettytable
 import inspect
+import itertools
+import socket
+import sqlite3
+import SocketServer
+import Queue
+import StringIO
 import threading
 import time
+import urlparse
+from concurrent import futures
 
-import keystoneclient.v2_0.client as keystone
 from keystoneauth1.identity import v2
 from keystoneauth1 import session
-import novaclient.client as nova
-from novaclient import utils as nova_utils
-import cinderclient.client as cinder
-from glanceclient.v1 import client as glance
-import neutronclient.v2_0.client as neutron
-import heatclient.client as heat
+import requests
+import requests.adapters
 import requests.packages.urllib3
+from requests.packages.urllib3.connection import HTTPConnection
+import msgpack
+import unicodecsv
+import yaml
 
 requests.packages.urllib3.disable_warnings()
 
 logger = logging.getLogger()
 
+# Number of rows requested per API call, by service type
+PAGE_SIZES = {'compute': 1000,
+              'volume': 1000,
+              'image': 1000,
+              'network': 1000,
+              'orchestration': 100}
+
+# Seconds a cached listing stays fresh, by resource type
+CACHE_TTLS = {'nova_limits': 60,
+              'cinder_limits': 60,
+              'servers': 60,
+              'flavors': 86400,
+              'floating_ips': 60,
+              'security_groups': 300,
+              'keypairs': 300,
+              'images': 3600,
+              'volumes': 60,
+              'volume_snapshots': 300,
+              'volume_backups': 300,
+              'routers': 300,
+              'networks': 300,
+              'subnets': 300,
+              'network_extensions': 86400,
+              'lbaas_pools': 300,
+              'lbaas_members': 300,
+              'loadbalancers': 300,
+              'listeners': 300,
+              'lbaas_v2_pools': 300,
+              'lbaas_v2_members': 300,
+              'healthmonitors': 300,
+              'stacks': 300,
+              'stack_resources': 300}
+
+# Inventory resources filled by each fetch
+FETCH_RESOURCES = collections.OrderedDict([('limits', ('limits',)),
+                                           ('servers', ('servers',)),
+                                           ('flavors', ('flavors',)),
+                                           ('images', ('images',)),
+                                           ('floating_ips', ('floating_ips',)),
+                                           ('security_groups', ('security_groups',)),
+                                           ('keypairs', ('keypairs',)),
+                                           ('volumes', ('volumes',)),
+                                           ('volume_snapshots', ('volume_snapshots',)),
+                                           ('volume_backups', ('volume_backups',)),
+                                           ('networks', ('networks', 'subnets', 'routers')),
+                                           ('network_extensions', ()),
+                                           ('lbaas', ('lbaas_pools', 'lbaas_members')),
+                                           ('loadbalancers', ('loadbalancers',)),
+                                           ('listeners', ('listeners',)),
+                                           ('lbaas_v2_pools', ('lbaas_v2_pools',)),
+                                           ('healthmonitors', ('healthmonitors',)),
+                                           ('lbaas_v2_members', ('lbaas_v2_members',)),
+                                           ('stacks', ('stacks',)),
+                                           ('stack_resources', ('nested_stacks', 'stack_resources',
+                                                                'stack_outputs'))])
+
+# Resources of the deep stack fetch, inventoried with --deep-stacks or when selected
+DEEP_STACK_RESOURCES = FETCH_RESOURCES['stack_resources']
+
+RESOURCE_FETCHES = dict((resource, fetch) for fetch, resources in FETCH_RESOURCES.items()
+                        for resource in resources)
+
+# Resources a section needs to be rendered, besides its own
+SECTION_NEEDS = {'servers': ('flavors', 'images'),
+                 'volumes': ('servers',),
+                 'networks': ('subnets',),
+                 'lbaas_pools': ('lbaas_members',),
+                 'lbaas_members': ('lbaas_pools',),
+                 'loadbalancers': ('listeners',),
+                 'lbaas_v2_pools': ('loadbalancers', 'healthmonitors', 'lbaas_v2_members'),
+                 'lbaas_v2_members': ('lbaas_v2_pools',),
+                 'nested_stacks': ('stacks',),
+                 'stack_resources': ('stacks', 'nested_stacks'),
+                 'stack_outputs': ('stacks', 'nested_stacks')}
+
+# Inventory resource and label of the Heat resource types, to link stack resources to
+STACK_RESOURCE_TYPES = {'OS::Nova::Server': ('servers', 'Server'),
+                        'OS::Cinder::Volume': ('volumes', 'Volume'),
+                        'OS::Neutron::Net': ('networks', 'Network'),
+                        'OS::Neutron::Subnet': ('subnets', 'Subnet'),
+                        'OS::Neutron::Router': ('routers', 'Router'),
+                        'OS::Neutron::SecurityGroup': ('security_groups', 'Security group')}
+
+# Client library of each service, imported when the service is first used
+CLIENT_MODULES = {'nova': 'novaclient.client',
+                  'cinder': 'cinderclient.client',
+                  'glance': 'glanceclient.v1.client',
+                  'neutron': 'neutronclient.v2_0.client',
+                  'heat': 'heatclient.client'}
+
+# Client of each service, created from its library, a session and a region name
+CLIENTS = {'nova': lambda module, sess, region: module.Client('2.1', region_name=region, session=sess),
+           'cinder': lambda module, sess, region: module.Client('2', region_name=region, session=sess),
+           'glance': lambda module, sess, region: module.Client('2', region_name=region, session=sess),
+           'neutron': lambda module, sess, region: module.Client(region_name=region, session=sess),
+           'heat': lambda module, sess, region: module.Client('1', region_name=region,
+                                                              service_type='orchestration', session=sess)}
+
+# HTTP connections kept open per endpoint, and endpoints with a pool
+POOL_SIZE = 20
+POOL_ENDPOINTS = 10
+
+# Fetchers run concurrently, and seconds after which a fetch is abandoned
+FETCH_WORKERS = 8
+FETCH_TIMEOUT = 120
+
+# Retries of a throttled API call, and seconds a run may spend waiting to retry
+RETRIES = 5
+RETRY_BUDGET = 120
+RETRY_STATUSES = (429, 503)
+
+# Stacks read at once by the deep stack fetch
+STACK_WORKERS = 10
+
+# Concurrent authentications allowed against one Keystone endpoint
+AUTH_CONCURRENCY = 4
+
+# Engines calling the APIs, and requests of the rest engine in flight for all projects
+ENGINES = ('clients', 'rest')
+ENGINE_CONCURRENCY = 32
+
+# Port of the HTTP server of the serve command
+SERVE_PORT = 9150
+
+# Margin applied to changes-since queries for clock differences with the APIs
+CLOCK_SKEW = 60
+
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                         'osinventory')
+
+CREDENTIALS = ('username', 'password', 'project', 'auth_url', 'region_name')
+
+TOKEN_CACHE = os.path.join(CACHE_DIR, 'tokens.json')
+
+SNAPSHOT_DIR = os.path.join(CACHE_DIR, 'snapshots')
+
+# SQLite store of the inventories queried by the query command, and the version
+# of its tables: a store of another version is emptied
+STORE_PATH = os.path.join(CACHE_DIR, 'inventory.sqlite')
+STORE_VERSION = 1
+
+# Columns referencing other resources in the store, indexed like ids, names and statuses
+STORE_REFERENCES = {'servers': ('flavor_id', 'image_id'),
+                    'floating_ips': ('instance_id',),
+                    'volume_snapshots': ('volume_id',),
+                    'volume_backups': ('volume_id',),
+                    'volume_attachments': ('volume_id', 'server_id'),
+                    'subnets': ('network_id',),
+                    'routers': ('network_id',),
+                    'lbaas_members': ('pool_id',),
+                    'lbaas_v2_members': ('pool_id',),
+                    'lbaas_v2_pools': ('healthmonitor_id',),
+                    'nested_stacks': ('parent_id',),
+                    'stack_resources': ('stack_id', 'physical_id', 'nested_stack_id'),
+                    'stack_outputs': ('stack_id',)}
+
+# Resources compared by the diff command
+DIFF_RESOURCES = ('servers', 'volumes', 'floating_ips', 'security_groups', 'security_group_rules', 'stacks')
+
+# Sections of more rows than this are streamed instead of rendered by prettytable
+STREAM_ROWS = 5000
+# Rows read to size the columns of a streamed section, and the least widths of
+# columns of UUIDs, in case the rows past the sample are wider
+STREAM_SAMPLE = 1000
+WIDTH_HINTS = {'ID': 36, 'Subnet ID': 36, 'Member ID': 36}
+
+# Columns of the CSV output, the other fields of a record go to a JSON details column
+CSV_COLUMNS = ['project', 'region', 'resource', 'id', 'name', 'status']
+
+# Rows of the limits section: name, service, max and used absolute limits
+LIMITS = (('Servers', 'nova', 'maxTotalInstances', 'totalInstancesUsed'),
+          ('Volumes', 'cinder', 'maxTotalVolumes', 'totalVolumesUsed'),
+          ('V_Snapshots', 'cinder', 'maxTotalSnapshots', 'totalSnapshotsUsed'),
+          ('V_Backups', 'cinder', 'maxTotalBackups', 'totalBackupsUsed'),
+          ('RAM (MB)', 'nova', 'maxTotalRAMSize', 'totalRAMUsed'),
+          ('Cores', 'nova', 'maxTotalCores', 'totalCoresUsed'),
+          ('VolumesGigabytes', 'cinder', 'maxTotalVolumeGigabytes', 'totalGigabytesUsed'),
+          ('BackupGigabyte', 'cinder', 'maxTotalBackupGigabytes', 'totalBackupGigabytesUsed'))
+
+# Filters of the listed resources, with the query parameter of the listing API
+# for each of them, None when the API cannot filter. The rows received are
+# filtered anyway, the API may return more of them.
+FILTERS = {'servers': {'status': 'status', 'name': 'name', 'created_after': 'changes-since', 'tag': None},
+           'volumes': {'status': 'status', 'name': None, 'created_after': None, 'tag': None},
+           'images': {'status': 'status', 'name': None, 'created_after': 'changes-since', 'tag': None,
+                      'category': 'is_public'}}
+
+# Field of the creation time of the rows, by resource type
+CREATED_FIELDS = {'servers': 'created', 'volumes': 'created_at', 'images': 'created_at'}
+
+# Categories of the public images, see get_image_category
+PUBLIC_CATEGORIES = ('cloudwatt', 'haas', 'orchestration', 'community')
+
+# Path segments replaced by {id} in the operations of the profile
+ID_SEGMENT = re.compile(r'^([0-9a-f]{32}|[0-9a-f-]{36}|\d+)$')
+
+# Name of the fetch running in the current thread, for the profile
+fetch_context = threading.local()
+
+profile_lock = threading.Lock()
+record_lock = threading.Lock()
+auth_semaphores = {}
+auth_semaphores_lock = threading.Lock()
+rest_engines = {}
+rest_engines_lock = threading.Lock()
+token_cache_lock = threading.Lock()
+
 
 def format_flavor_details(f):
     # f = client.flavors.get(flavor_id).to_dict()
@@ -37,14 +260,17 @@ def get_server_image_name(client, server):
     return name
 
 
-def get_image_category(image, user_tenant_id):
+def get_image_category(image, user_tenant_id, properties=None):
     """Get image category
 
+    image is a dict, properties its properties when they are already read.
     """
-    cw_origin = image.properties.get('cw_origin')
-    cw_bundle = image.properties.get('cw_bundle')
-    cw_haas = image.properties.get('cw_haas')
-    if image.is_public:
+    if properties is None:
+        properties = image.get('properties') or {}
+    cw_origin = properties.get('cw_origin')
+    cw_bundle = properties.get('cw_bundle')
+    cw_haas = properties.get('cw_haas')
+    if image.get('is_public'):
         if cw_origin and cw_origin.lower() == 'cloudwatt':
             if cw_haas and cw_haas.lower().strip() == 'haas':
                 return 'haas'
@@ -52,17 +278,1287 @@ def get_image_category(image, user_tenant_id):
                 return 'orchestration'
             return 'cloudwatt'
         return 'community'
-    if image.owner == user_tenant_id:
+    if image.get('owner') == user_tenant_id:
         return 'project'
     return 'shared'
 
 
-def session_create(config):
-    auth = v2.Password(auth_url=config['auth_url'],
-                       username=config['username'],
-                       password=config['password'],
-                       tenant_id=config['project'])
-    return session.Session(auth=auth)
+def filter_query(resource, filters):
+    """Return the query parameters of the filters of resource that its listing API supports"""
+    query = {}
+    for name, value in filters.items():
+        parameter = FILTERS[resource][name]
+        if parameter is None:
+            continue
+        if name == 'category':
+            value = value in PUBLIC_CATEGORIES
+        query[parameter] = value
+    return query
+
+
+def row_matcher(resource, filters, project):
+    """Return a function telling whether a row of resource matches the filters
+
+    Rows deleted are returned by the APIs filtering on changes-since, they
+    never match.
+    """
+    name = re.compile(filters['name']) if 'name' in filters else None
+
+    def matches(row):
+        data = as_dict(row)
+        if data.get('deleted') or data.get('status') in ('DELETED', 'deleted'):
+            return False
+        if 'status' in filters and (data.get('status') or '').lower() != filters['status'].lower():
+            return False
+        if name and not name.search(data.get('name') or ''):
+            return False
+        if 'created_after' in filters and (data.get(CREATED_FIELDS[resource]) or '') < filters['created_after']:
+            return False
+        # Without tags in the API version used, the keys of the metadata are the tags
+        if 'tag' in filters and filters['tag'] not in (data.get('tags') or data.get('metadata') or
+                                                       data.get('properties') or ()):
+            return False
+        if 'category' in filters and get_image_category(data, project) != filters['category']:
+            return False
+        return True
+
+    return matches
+
+
+def filtered_pages(pages, matches):
+    """Yield the pages without the rows that do not match"""
+    for page in pages:
+        yield [row for row in page if matches(row)]
+
+
+def auth_semaphore(auth_url, limit=AUTH_CONCURRENCY):
+    """Return the semaphore bounding concurrent authentications against auth_url"""
+    with auth_semaphores_lock:
+        if auth_url not in auth_semaphores:
+            auth_semaphores[auth_url] = threading.BoundedSemaphore(limit)
+        return auth_semaphores[auth_url]
+
+
+class ThrottledPassword(v2.Password):
+    """Password authentication holding the semaphore of its Keystone endpoint"""
+
+    def __init__(self, auth_concurrency=AUTH_CONCURRENCY, **kwargs):
+        super(ThrottledPassword, self).__init__(**kwargs)
+        self.auth_concurrency = auth_concurrency
+
+    def get_auth_ref(self, session, **kwargs):
+        with auth_semaphore(self.auth_url, self.auth_concurrency):
+            return super(ThrottledPassword, self).get_auth_ref(session, **kwargs)
+
+
+def retry_after(response):
+    """Return the seconds to wait given by the Retry-After header of response, if any"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    date = email.utils.parsedate_tz(value)
+    if date is None:
+        return None
+    return max(email.utils.mktime_tz(date) - time.time(), 0)
+
+
+class RetryPolicy(object):
+    """Jittered exponential backoff, bounded by a budget of seconds shared by a run
+
+    Retry-After is honoured when the API gives it. Once the budget is
+    spent, calls are not retried anymore and their error goes through.
+    """
+
+    def __init__(self, retries=RETRIES, budget=RETRY_BUDGET, base=0.5, cap=30):
+        self.retries = retries
+        self.remaining = budget
+        self.base = base
+        self.cap = cap
+        self.retried = 0
+        self.lock = threading.Lock()
+
+    def delay(self, attempt, response):
+        """Return the seconds to wait before retrying, or None to give up"""
+        if attempt >= self.retries:
+            return None
+        delay = retry_after(response)
+        if delay is None:
+            delay = random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+        with self.lock:
+            if delay > self.remaining:
+                return None
+            self.remaining -= delay
+            self.retried += 1
+        return delay
+
+
+class PoolingAdapter(requests.adapters.HTTPAdapter):
+    """HTTP adapter with a keep-alive pool per endpoint, counting connections
+
+    Throttled calls (429, or 503 for reads) are retried according to
+    `retry`, which may be shared by the adapters of a run, and counted in
+    `retried`. Every call is recorded by `profiler` and `recorder`, if any.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, retry=None, profiler=None, recorder=None):
+        self.pools = set()
+        self.pools_lock = threading.Lock()
+        self.retry = retry or RetryPolicy()
+        self.retried = 0
+        self.retried_lock = threading.Lock()
+        self.profiler = profiler
+        self.recorder = recorder
+        super(PoolingAdapter, self).__init__(pool_connections=POOL_ENDPOINTS,
+                                             pool_maxsize=pool_size)
+
+    def init_poolmanager(self, *args, **kwargs):
+        # Keep idle connections alive at the TCP level too, as keystoneauth does
+        kwargs.setdefault('socket_options', HTTPConnection.default_socket_options +
+                          [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)])
+        super(PoolingAdapter, self).init_poolmanager(*args, **kwargs)
+
+    def get_connection(self, url, proxies=None):
+        pool = super(PoolingAdapter, self).get_connection(url, proxies)
+        with self.pools_lock:
+            self.pools.add(pool)
+        return pool
+
+    def send(self, request, **kwargs):
+        attempt = 0
+        while True:
+            started = time.time()
+            response = super(PoolingAdapter, self).send(request, **kwargs)
+            if self.profiler:
+                self.profiler.record_call(request.method, request.url, response.status_code,
+                                          time.time() - started, len(response.content),
+                                          count_rows(response))
+            if self.recorder:
+                self.recorder.record(request, response)
+            if response.status_code not in RETRY_STATUSES or \
+                    (response.status_code != 429 and request.method not in ('GET', 'HEAD')):
+                return response
+            delay = self.retry.delay(attempt, response)
+            if delay is None:
+                return response
+            with self.retried_lock:
+                self.retried += 1
+            logging.warning("%s %s returned %s, retrying in %.1f seconds"
+                            % (request.method, request.url, response.status_code, delay))
+            response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def connection_stats(self):
+        """Return the number of connections opened and of requests that reused one"""
+        with self.pools_lock:
+            opened = sum(pool.num_connections for pool in self.pools)
+            sent = sum(pool.num_requests for pool in self.pools)
+        return opened, max(sent - opened, 0)
+
+
+def session_create(config, profiler=None):
+    auth = ThrottledPassword(auth_url=config['auth_url'],
+                             username=config['username'],
+                             password=config['password'],
+                             tenant_id=config['project'],
+                             auth_concurrency=config.get('auth_concurrency', AUTH_CONCURRENCY))
+    if config.get('token_cache'):
+        load_auth_state(auth, config)
+    http = requests.Session()
+    # The retry policy of the run, shared by the sessions of its projects
+    retry = config.get('retry') or RetryPolicy(config.get('retries', RETRIES),
+                                               config.get('retry_budget', RETRY_BUDGET))
+    adapter = PoolingAdapter(config.get('pool_size', POOL_SIZE),
+                             retry,
+                             profiler,
+                             Recorder(config['record']) if config.get('record') else None)
+    http.mount('http://', adapter)
+    http.mount('https://', adapter)
+    http.headers['Connection'] = 'keep-alive'
+    http.headers['Accept-Encoding'] = 'gzip, deflate' if config.get('gzip', True) else 'identity'
+    return session.Session(auth=auth, session=http)
+
+
+def token_cache_key(config):
+    return hashlib.sha1('|'.join([config['auth_url'], config['username'],
+                                  config['project']])).hexdigest()
+
+
+def load_auth_state(auth, config):
+    """Restore in auth the token cached for the credentials of config
+
+    An expired token is ignored by keystoneauth, which authenticates again.
+    """
+    try:
+        with open(config['token_cache']) as f:
+            state = json.load(f).get(token_cache_key(config))
+    except (IOError, ValueError):
+        return
+    if state:
+        auth.set_auth_state(state)
+
+
+def save_auth_state(auth, config):
+    """Store in the token cache file the token of auth, readable by the user only"""
+    state = auth.get_auth_state()
+    if not state:
+        return
+    path = config['token_cache']
+    with token_cache_lock:
+        try:
+            with open(path) as f:
+                states = json.load(f)
+        except (IOError, ValueError):
+            states = {}
+        states[token_cache_key(config)] = state
+        if not os.path.isdir(os.path.dirname(path) or '.'):
+            os.makedirs(os.path.dirname(path), 0700)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600), 'w') as f:
+            json.dump(states, f)
+        os.rename(tmp_path, path)
+
+
+def load_clouds(path, names=None):
+    """Return the credentials of each cloud and region of a clouds.yaml file"""
+    with open(path) as f:
+        clouds = (yaml.safe_load(f) or {}).get('clouds', {})
+    targets = []
+    for name in sorted(clouds):
+        if names and name not in names:
+            continue
+        auth = clouds[name].get('auth', {})
+        for region in clouds[name].get('regions') or [clouds[name].get('region_name')]:
+            if isinstance(region, dict):
+                region = region.get('name')
+            targets.append({'username': auth.get('username'),
+                            'password': auth.get('password'),
+                            'project': auth.get('project_id') or auth.get('tenant_id'),
+                            'auth_url': auth.get('auth_url'),
+                            'region_name': region})
+    return targets
+
+
+def marker_pages(list_page, page_size):
+    """Yield the pages of a listing that supports marker/limit
+
+    The listing is followed until an empty page is returned, so that
+    a server side cap on the page size does not truncate it.
+    """
+    marker = None
+    while True:
+        page = list(list_page(marker=marker, limit=page_size))
+        if not page:
+            return
+        yield page
+        marker = page[-1].id
+
+
+def neutron_pages(list_resources, resource, page_size, **params):
+    """Yield the pages of a neutron listing, following its next links"""
+    for response in list_resources(retrieve_all=False, limit=page_size, **params):
+        yield response[resource]
+
+
+def nested_stack_id(resource):
+    """Return the ID of the nested stack of a Heat resource row, None if it has none"""
+    for link in resource.get('links') or []:
+        if link.get('rel') == 'nested':
+            return resource.get('physical_resource_id') or link['href'].rstrip('/').rsplit('/', 1)[1]
+    return None
+
+
+def is_not_found(error):
+    """Whether an error of a client library or of keystoneauth is an HTTP 404"""
+    return 404 in (getattr(error, 'http_status', None), getattr(error, 'code', None))
+
+
+def walk(roots, visit, workers):
+    """Yield the results of visit for the roots and the nodes they lead to
+
+    visit(node) returns its result and the nodes it leads to. Each node is
+    visited once, by at most workers threads at a time, and the results
+    are yielded as the visits end.
+    """
+    executor = futures.ThreadPoolExecutor(max_workers=workers)
+    seen = set()
+    pending = set()
+    try:
+        for node in roots:
+            if node not in seen:
+                seen.add(node)
+                pending.add(executor.submit(visit, node))
+        while pending:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                result, nodes = future.result()
+                for node in nodes:
+                    if node not in seen:
+                        seen.add(node)
+                        pending.add(executor.submit(visit, node))
+                yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown()
+
+
+def to_dicts(pages):
+    for page in pages:
+        yield [x.to_dict() for x in page]
+
+
+def single_page(list_all):
+    """Yield a listing that does not support pagination as one page"""
+    yield list(list_all())
+
+
+def current_fetch():
+    return getattr(fetch_context, 'name', None) or 'main'
+
+
+def count_rows(response):
+    """Return the length of the list in a JSON listing response, 0 otherwise"""
+    if 'json' not in response.headers.get('Content-Type', ''):
+        return 0
+    try:
+        body = json.loads(response.content)
+    except ValueError:
+        return 0
+    if isinstance(body, dict):
+        for value in body.values():
+            if isinstance(value, list):
+                return len(value)
+    return 0
+
+
+def call_operation(method, url, endpoints):
+    """Return the service type and the operation of an API call
+
+    endpoints maps endpoint URLs to service types. Ids are replaced in the
+    operation, e.g. ('compute', 'GET /servers/{id}').
+    """
+    path = url.split('?')[0]
+    service = 'unknown'
+    for endpoint in sorted(endpoints, key=len, reverse=True):
+        if path.startswith(endpoint):
+            service = endpoints[endpoint]
+            path = path[len(endpoint):]
+            break
+    else:
+        path = urlparse.urlparse(path).path
+    path = '/'.join('{id}' if ID_SEGMENT.match(segment) else segment
+                    for segment in path.split('/'))
+    return service, '%s %s' % (method, path or '/')
+
+
+def is_projected(url):
+    """Whether an API call asks for the fields shown only: neutron fields, or snapshots without details"""
+    parsed = urlparse.urlparse(url)
+    return 'fields' in urlparse.parse_qs(parsed.query) or parsed.path.rstrip('/').endswith('/snapshots')
+
+
+class Profiler(object):
+    """Latency, payload and rows of the API calls and fetches of a run
+
+    An API call is attributed to the fetch running in the calling thread.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.calls = []
+        self.fetches = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def record_call(self, method, url, status, latency, size, rows):
+        with self.lock:
+            self.calls.append({'fetch': current_fetch(), 'method': method, 'url': url,
+                               'status': status, 'latency': latency, 'bytes': size, 'rows': rows,
+                               'projected': is_projected(url)})
+
+    def start_fetch(self, name, depends=()):
+        with self.lock:
+            self.fetches.setdefault(name, {'start': time.time() - self.started, 'end': None,
+                                           'depends': list(depends)})
+
+    def end_fetch(self, name):
+        with self.lock:
+            fetch = self.fetches[name]
+            fetch['end'] = max(fetch['end'], time.time() - self.started)
+
+    def critical_path(self):
+        """Return the fetches ending last, following their dependencies"""
+        ended = dict((name, fetch) for name, fetch in self.fetches.items() if fetch['end'] is not None)
+        path = []
+        candidates = ended.keys()
+        while candidates:
+            name = max(candidates, key=lambda n: ended[n]['end'])
+            path.append(name)
+            candidates = [d for d in ended[name]['depends'] if d in ended]
+        return path
+
+    def records(self, endpoints):
+        """Yield the calls and fetches as dicts"""
+        for call in self.calls:
+            service, operation = call_operation(call['method'], call['url'], endpoints)
+            yield dict(call, type='call', service=service, operation=operation)
+        for name, fetch in self.fetches.items():
+            calls = [c for c in self.calls if c['fetch'] == name]
+            yield dict(fetch, type='fetch', fetch=name, bytes=sum(c['bytes'] for c in calls),
+                       projected_calls=sum(c['projected'] for c in calls))
+
+    def report(self, out, endpoints):
+        fetches_table = prettytable.PrettyTable(['Fetch', 'Start (s)', 'Duration (s)', 'API calls',
+                                                 'Projected', 'API time (s)', 'Bytes received', 'Rows'])
+        for name, fetch in self.fetches.items():
+            calls = [c for c in self.calls if c['fetch'] == name]
+            duration = '%.3f' % (fetch['end'] - fetch['start']) if fetch['end'] is not None else 'running'
+            fetches_table.add_row([name, '%.3f' % fetch['start'], duration, len(calls),
+                                   sum(c['projected'] for c in calls),
+                                   '%.3f' % sum(c['latency'] for c in calls),
+                                   sum(c['bytes'] for c in calls), sum(c['rows'] for c in calls)])
+
+        operations = collections.defaultdict(list)
+        for call in self.calls:
+            operations[call_operation(call['method'], call['url'], endpoints)].append(call)
+        calls_table = prettytable.PrettyTable(['Service', 'Operation', 'Calls', 'Total (s)',
+                                               'Max (s)', 'KB received', 'Rows'])
+        for (service, operation), calls in sorted(operations.items()):
+            calls_table.add_row([service, operation, len(calls),
+                                 '%.3f' % sum(c['latency'] for c in calls),
+                                 '%.3f' % max(c['latency'] for c in calls),
+                                 sum(c['bytes'] for c in calls) / 1024, sum(c['rows'] for c in calls)])
+
+        print >>out, '\nProfile by fetch\n'
+        print >>out, fetches_table
+        print >>out, '\nProfile by API operation\n'
+        print >>out, calls_table
+        print >>out, '\nCritical path: %s' % ' <- '.join(
+            '%s (%.3fs)' % (name, self.fetches[name]['end']) for name in self.critical_path())
+        print >>out, 'Total: %.3f seconds\n' % (time.time() - self.started)
+
+    def write_jsonl(self, path, endpoints, **fields):
+        """Append the calls and fetches to path, one JSON record per line"""
+        with profile_lock:
+            with open(path, 'a') as f:
+                for record in self.records(endpoints):
+                    record.update(fields)
+                    f.write(json.dumps(record) + '\n')
+
+
+class Recorder(object):
+    """Append the API responses of a run to a fixture file, as JSON lines
+
+    The fixture can be replayed by osfake.py. Request bodies, which hold
+    the password, are not recorded, but the token response is.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def record(self, request, response):
+        record = {'method': request.method, 'url': request.url, 'status': response.status_code,
+                  'content_type': response.headers.get('Content-Type'), 'body': response.text}
+        with record_lock:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+
+class PagedCollection(object):
+    """Rows of a paginated listing, retrieved by a background thread
+
+    At most `prefetch` pages are held in memory at once, so rows can be
+    rendered while the next pages are still being retrieved. A collection
+    can only be iterated once.
+
+    When the listing fails, or a page takes more than `timeout` seconds to
+    arrive, iteration stops and `name` is recorded in the `incomplete`
+    dict with the reason. The background thread stops between two pages
+    once `cancelled` is set, and calls `on_end` when it is done.
+    """
+
+    def __init__(self, pages, error_message, prefetch=2, name=None, timeout=None,
+                 cancelled=None, incomplete=None, profiler=None, on_end=None):
+        self.error_message = error_message
+        self.profiler = profiler
+        self.on_end = on_end
+        self.name = name
+        self.timeout = timeout
+        self.cancelled = cancelled or threading.Event()
+        self.incomplete = incomplete if incomplete is not None else {}
+        self.queue = Queue.Queue(maxsize=prefetch)
+        self.thread = threading.Thread(target=self._produce, args=(pages,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _produce(self, pages):
+        fetch_context.name = self.name
+        if self.profiler:
+            self.profiler.start_fetch(self.name)
+        try:
+            for page in pages:
+                if self.cancelled.is_set():
+                    break
+                self.queue.put(page)
+        except Exception as e:
+            logging.error(self.error_message)
+            self.incomplete[self.name] = 'failed'
+        if self.profiler:
+            self.profiler.end_fetch(self.name)
+        if self.on_end:
+            self.on_end()
+        self.queue.put(None)
+
+    def pages(self):
+        while True:
+            try:
+                page = self.queue.get(timeout=self.timeout)
+            except Queue.Empty:
+                logging.error("Timed out retrieving %s" % self.name)
+                self.incomplete[self.name] = 'timed out'
+                return
+            if page is None:
+                return
+            yield page
+
+    def __iter__(self):
+        for page in self.pages():
+            for row in page:
+                yield row
+
+
+def resource_to_dict(row):
+    """Return the attributes of a client resource, or the row if it is a dict"""
+    if isinstance(row, dict):
+        return row
+    return dict((k, v) for k, v in vars(row).items()
+                if not k.startswith('_') and k != 'manager')
+
+
+class CachedResource(dict):
+    """A row read from the cache or the REST APIs, usable like the client resource it replaces"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+    def to_dict(self):
+        return dict(self)
+
+
+class InventoryCache(object):
+    """On disk cache of the listings of one project
+
+    Each resource type is stored as a JSON lines file, in a directory keyed
+    by auth_url, region, project and whether the rows are projected to the
+    fields shown. A file is fresh while it is younger than the TTL of its
+    resource type.
+    """
+
+    def __init__(self, config, ttls, directory=CACHE_DIR, page_size=1000):
+        key = '|'.join([config['auth_url'], config['region_name'], config['project']])
+        if not config.get('projection', True):
+            key += '|whole rows'
+        self.directory = os.path.join(directory, hashlib.sha1(key).hexdigest())
+        self.ttls = ttls
+        self.page_size = page_size
+        self.deltas = {}
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, 0700)
+
+    def path(self, resource):
+        return os.path.join(self.directory, resource + '.jsonl')
+
+    def exists(self, resource):
+        return os.path.exists(self.path(resource))
+
+    def fresh(self, resource):
+        try:
+            age = time.time() - os.path.getmtime(self.path(resource))
+        except OSError:
+            return False
+        return age < self.ttls.get(resource, 0)
+
+    def expire(self, resource):
+        """Forget the cached rows of resource, for the next run to list them again"""
+        if self.exists(resource):
+            os.remove(self.path(resource))
+
+    def pages(self, resource, pages):
+        """Yield the cached pages of resource if fresh, else store pages"""
+        if self.fresh(resource):
+            return self._load(resource)
+        return self._store(resource, pages)
+
+    def _load(self, resource):
+        page = []
+        with open(self.path(resource)) as f:
+            for line in f:
+                page.append(CachedResource(json.loads(line)))
+                if len(page) == self.page_size:
+                    yield page
+                    page = []
+        if page:
+            yield page
+
+    def merge(self, resource, list_changes, is_deleted):
+        """Yield the stored pages of resource, updated with the changed rows
+
+        list_changes(since) yields the pages of the rows changed since an
+        ISO 8601 time, deleted rows included. The changes are recorded in
+        deltas.
+        """
+        since = time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                              time.gmtime(os.path.getmtime(self.path(resource)) - CLOCK_SKEW))
+        rows = collections.OrderedDict()
+        for page in self._load(resource):
+            for row in page:
+                rows[row['id']] = row
+
+        delta = {'added': [], 'removed': [], 'modified': []}
+        for page in list_changes(since):
+            for row in page:
+                row = CachedResource(json.loads(json.dumps(resource_to_dict(row))))
+                if is_deleted(row):
+                    if rows.pop(row['id'], None) is not None:
+                        delta['removed'].append(row['id'])
+                    continue
+                if row['id'] not in rows:
+                    delta['added'].append(row['id'])
+                elif rows[row['id']] != row:
+                    delta['modified'].append(row['id'])
+                rows[row['id']] = row
+        self.deltas[resource] = delta
+
+        values = rows.values()
+        pages = (values[i:i + self.page_size] for i in range(0, len(values), self.page_size))
+        for page in self._store(resource, pages):
+            yield page
+
+    def _store(self, resource, pages):
+        path = self.path(resource)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        started = time.time()
+        try:
+            with open(tmp_path, 'w') as f:
+                for page in pages:
+                    for row in page:
+                        f.write(json.dumps(resource_to_dict(row)) + '\n')
+                    yield page
+            os.rename(tmp_path, path)
+            # Changes made while listing are picked up by the next merge
+            os.utime(path, (started, started))
+        finally:
+            # Left when the listing fails or is not read to the end
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class RestEngine(object):
+    """Run the requests of the rest engine on one pool of threads
+
+    The projects inventoried by a process share the pool, which bounds the
+    number of requests in flight. A request runs in the name of the fetch
+    which sent it, for the profile.
+    """
+
+    def __init__(self, concurrency=ENGINE_CONCURRENCY):
+        self.executor = futures.ThreadPoolExecutor(max_workers=concurrency)
+
+    def get(self, sess, endpoint, path, params=None, headers=None):
+        """Return the future JSON body of a GET on path, relative to the endpoint or absolute"""
+        name = current_fetch()
+
+        def request():
+            fetch_context.name = name
+            return sess.get(path, endpoint_filter=endpoint, params=params, headers=dict(headers or {})).json()
+
+        return self.executor.submit(request)
+
+
+def rest_engine(concurrency=ENGINE_CONCURRENCY):
+    """Return the rest engine shared by the projects of the process"""
+    with rest_engines_lock:
+        if concurrency not in rest_engines:
+            rest_engines[concurrency] = RestEngine(concurrency)
+        return rest_engines[concurrency]
+
+
+def request_key(path, params):
+    """Return a key identifying a GET on path with params, lists of values included"""
+    return path, tuple(sorted((key, tuple(value) if isinstance(value, list) else value)
+                              for key, value in params.items()))
+
+
+class RestService(object):
+    """Client of a service calling its REST API through the rest engine
+
+    It has the managers and methods of the client library used by the
+    fetchers, and returns the same rows, as dicts. Once a page of a listing
+    is received, the next one is requested without waiting to be asked for.
+    """
+    service_type = None
+    headers = None
+
+    def __init__(self, engine, sess, region):
+        self.engine = engine
+        self.session = sess
+        self.endpoint = {'service_type': self.service_type, 'region_name': region, 'interface': 'public'}
+        self.prefetched = {}
+        self.lock = threading.Lock()
+
+    def get(self, path, params=None):
+        """Return the future body of a GET, the one already requested if any"""
+        params = dict((key, value) for key, value in (params or {}).items() if value is not None)
+        with self.lock:
+            future = self.prefetched.pop(request_key(path, params), None)
+        return future or self.engine.get(self.session, self.endpoint, path, params, self.headers)
+
+    def prefetch(self, path, params=None):
+        params = dict((key, value) for key, value in (params or {}).items() if value is not None)
+        with self.lock:
+            key = request_key(path, params)
+            if key not in self.prefetched:
+                self.prefetched[key] = self.engine.get(self.session, self.endpoint, path, params, self.headers)
+
+    def rows(self, path, key, params=None):
+        """Return the rows of a page, requesting the next page when this one is full"""
+        params = params or {}
+        rows = [CachedResource(row) for row in self.get(path, params).result()[key]]
+        if params.get('limit') and len(rows) >= int(params['limit']):
+            self.prefetch(path, dict(params, marker=rows[-1]['id']))
+        return rows
+
+
+class RestManager(object):
+    """Resource of a RestService, listed and read as by the managers of the client libraries"""
+
+    def __init__(self, service, path, key, detail=True):
+        self.service = service
+        self.path = path
+        self.key = key
+        self.detail = detail
+
+    def list(self, detailed=True, search_opts=None, marker=None, limit=None):
+        path = self.path + '/detail' if self.detail and detailed else self.path
+        return self.service.rows(path, self.key, dict(search_opts or {}, marker=marker, limit=limit))
+
+    def get(self, resource_id=None):
+        """Return the resource with this ID, or the resource of the path without"""
+        if resource_id is None:
+            return CachedResource(self.service.get(self.path).result()[self.key])
+        return CachedResource(self.service.get('%s/%s' % (self.path, resource_id)).result()[self.key[:-1]])
+
+
+class RestImages(RestManager):
+
+    def list(self, page_size=None, filters=None):
+        """Yield the images, following the pages as glanceclient v1 does"""
+        params = dict(filters or {}, limit=page_size)
+        while True:
+            rows = self.service.rows(self.path, self.key, params)
+            for row in rows:
+                yield row
+            if not rows or (page_size and len(rows) < page_size):
+                return
+            params = dict(params, marker=rows[-1]['id'])
+
+
+class RestStackResources(RestManager):
+
+    def list(self, stack_id):
+        return self.service.rows(self.path % stack_id, self.key)
+
+
+class RestNova(RestService):
+    service_type = 'compute'
+    headers = {'X-OpenStack-Nova-API-Version': '2.1'}
+
+    def __init__(self, engine, sess, region):
+        RestService.__init__(self, engine, sess, region)
+        self.limits = RestManager(self, '/limits', 'limits', detail=False)
+        self.servers = RestManager(self, '/servers', 'servers')
+        self.flavors = RestManager(self, '/flavors', 'flavors')
+        self.floating_ips = RestManager(self, '/os-floating-ips', 'floating_ips', detail=False)
+        self.security_groups = RestManager(self, '/os-security-groups', 'security_groups', detail=False)
+        self.keypairs = RestManager(self, '/os-keypairs', 'keypairs', detail=False)
+
+
+class RestCinder(RestService):
+    service_type = 'volumev2'
+
+    def __init__(self, engine, sess, region):
+        RestService.__init__(self, engine, sess, region)
+        self.limits = RestManager(self, '/limits', 'limits', detail=False)
+        self.volumes = RestManager(self, '/volumes', 'volumes')
+        self.volume_snapshots = RestManager(self, '/snapshots', 'snapshots')
+        self.backups = RestManager(self, '/backups', 'backups')
+
+
+class RestGlance(RestService):
+    service_type = 'image'
+
+    def __init__(self, engine, sess, region):
+        RestService.__init__(self, engine, sess, region)
+        self.images = RestImages(self, '/v1/images/detail', 'images')
+
+
+class RestHeat(RestService):
+    service_type = 'orchestration'
+
+    def __init__(self, engine, sess, region):
+        RestService.__init__(self, engine, sess, region)
+        self.stacks = RestManager(self, '/stacks', 'stacks', detail=False)
+        self.resources = RestStackResources(self, '/stacks/%s/resources', 'resources')
+
+
+def neutron_listing(resource, path):
+    """Return a RestNeutron method listing resource, as the one of neutronclient"""
+    def list_resources(self, *args, **params):
+        retrieve_all = params.pop('retrieve_all', True)
+        pages = self.pages(resource, '/v2.0' + path % args + '.json', params)
+        if not retrieve_all:
+            return pages
+        return {resource: [row for page in pages for row in page[resource]]}
+    return list_resources
+
+
+class RestNeutron(RestService):
+    service_type = 'network'
+
+    def pages(self, resource, path, params):
+        """Yield the responses of a listing, following their next links"""
+        while path:
+            body = self.get(path, params).result()
+            params = None
+            path = next((link['href'] for link in body.get(resource + '_links', ()) if link['rel'] == 'next'),
+                        None)
+            if path:
+                self.prefetch(path)
+            yield body
+
+    list_extensions = neutron_listing('extensions', '/extensions')
+    list_networks = neutron_listing('networks', '/networks')
+    list_subnets = neutron_listing('subnets', '/subnets')
+    list_routers = neutron_listing('routers', '/routers')
+    list_pools = neutron_listing('pools', '/lb/pools')
+    list_members = neutron_listing('members', '/lb/members')
+    list_loadbalancers = neutron_listing('loadbalancers', '/lbaas/loadbalancers')
+    list_listeners = neutron_listing('listeners', '/lbaas/listeners')
+    list_lbaas_pools = neutron_listing('pools', '/lbaas/pools')
+    list_lbaas_healthmonitors = neutron_listing('healthmonitors', '/lbaas/healthmonitors')
+    list_lbaas_members = neutron_listing('members', '/lbaas/pools/%s/members')
+
+
+# Client of each service for the rest engine
+REST_CLIENTS = {'nova': RestNova,
+                'cinder': RestCinder,
+                'glance': RestGlance,
+                'neutron': RestNeutron,
+                'heat': RestHeat}
+
+
+class FetchScheduler(object):
+    """Run fetchers on a bounded pool of worker threads
+
+    Fetchers start in the order they were added, once the fetchers they
+    depend on are done. A fetcher still running `timeout` seconds after it
+    started is abandoned: it is reported as incomplete, along with the
+    fetchers depending on it, which are not started, and its worker is
+    replaced so that the other fetchers keep running. A fetcher which
+    raises is reported as failed, the fetchers depending on it are not
+    started either, and its worker goes on with the next fetchers.
+
+    The timeout bounds the fetcher call. A paged listing is returned as a
+    PagedCollection as soon as it starts, its pages are bounded by their
+    own timeout: a listing is incomplete when one of its pages takes more
+    than `timeout` seconds to arrive, however long the whole listing takes.
+    """
+
+    def __init__(self, workers=FETCH_WORKERS, timeout=FETCH_TIMEOUT, profiler=None):
+        self.workers = workers
+        self.timeout = timeout
+        self.profiler = profiler
+        self.fetchers = collections.OrderedDict()
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        # Start time of the last run of each fetcher
+        self.started = {}
+        # Duration and end time of the last run of each fetcher
+        self.durations = {}
+
+    def add(self, name, func, depends=()):
+        self.fetchers[name] = (func, depends)
+
+    def cancel(self):
+        """Skip the fetchers not started yet and stop the paged listings"""
+        self.cancelled.set()
+
+    def end_fetch(self, name, started):
+        """Record that the run of a fetcher begun at `started` is done
+
+        A fetcher returning a paged listing is done when its last page is
+        retrieved, after the fetcher itself has returned.
+        """
+        end = time.time()
+        with self.lock:
+            if self.started.get(name) != started:
+                # A later run of the fetcher has begun
+                return
+            if end >= self.durations.get(name, (0, 0))[1]:
+                self.durations[name] = (end - started, end)
+
+    def run(self, names=None):
+        """Run the fetchers, or those named, and return why those which did not complete did not
+
+        The reasons are 'timed out', 'failed' or 'skipped', by fetcher name.
+        Dependencies on fetchers which are not run are ignored.
+        """
+        fetchers = collections.OrderedDict(
+            (name, (func, tuple(d for d in depends if names is None or d in names)))
+            for name, (func, depends) in self.fetchers.items() if names is None or name in names)
+        tasks = Queue.Queue()
+        done = Queue.Queue()
+        lock = threading.Lock()
+        started = {}
+        finished = set()
+        abandoned = set()
+        # Why the fetchers abandoned, failed or skipped did not complete
+        reasons = {}
+
+        def work():
+            while True:
+                name, func = tasks.get()
+                with lock:
+                    started[name] = time.time()
+                with self.lock:
+                    self.started[name] = started[name]
+                fetch_context.name = name
+                if self.profiler:
+                    self.profiler.start_fetch(name, self.fetchers[name][1])
+                try:
+                    if not self.cancelled.is_set():
+                        func()
+                except Exception as e:
+                    logging.error("Could not retrieve %s: %s" % (name, e))
+                    with lock:
+                        reasons.setdefault(name, 'failed')
+                finally:
+                    if self.profiler:
+                        self.profiler.end_fetch(name)
+                    self.end_fetch(name, started[name])
+                    done.put(name)
+                with lock:
+                    if name in abandoned:
+                        # A replacement worker was started when it was abandoned
+                        return
+
+        def start_worker():
+            worker = threading.Thread(target=work)
+            worker.daemon = True
+            worker.start()
+
+        for i in range(min(self.workers, len(fetchers))):
+            start_worker()
+
+        submitted = set()
+        while len(finished) + len(abandoned) < len(fetchers):
+            for name, (func, depends) in fetchers.items():
+                if name in submitted:
+                    continue
+                if any(d in reasons for d in depends):
+                    submitted.add(name)
+                    abandoned.add(name)
+                    reasons[name] = 'skipped'
+                    logging.error("Skipped %s, it depends on an incomplete fetch" % name)
+                elif all(d in finished for d in depends):
+                    submitted.add(name)
+                    tasks.put((name, func))
+
+            with lock:
+                deadlines = [started[name] + self.timeout for name in started
+                             if name not in finished and name not in abandoned]
+            wait = min(deadlines) - time.time() if deadlines else self.timeout
+            try:
+                name = done.get(timeout=max(wait, 0.01))
+                with lock:
+                    if name not in abandoned:
+                        finished.add(name)
+            except Queue.Empty:
+                pass
+
+            with lock:
+                for name in started:
+                    if (name not in finished and name not in abandoned and
+                            time.time() - started[name] >= self.timeout):
+                        abandoned.add(name)
+                        reasons[name] = 'timed out'
+                        logging.error("Timed out retrieving %s" % name)
+                        start_worker()
+        return reasons
+
+
+class RecordWriter(object):
+    """Write inventory records to a stream as they come
+
+    Records are written whole under a lock, so that the inventories of
+    several projects can share a writer.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        data = self.encode(record)
+        with self.lock:
+            self.stream.write(data)
+
+
+class JsonLinesWriter(RecordWriter):
+    def encode(self, record):
+        return json.dumps(record, default=str) + '\n'
+
+
+class MsgpackWriter(RecordWriter):
+    def encode(self, record):
+        return msgpack.packb(record, default=str)
+
+
+class CsvWriter(RecordWriter):
+    """Write records as CSV rows of CSV_COLUMNS, with their other fields in JSON"""
+
+    def __init__(self, stream):
+        RecordWriter.__init__(self, stream)
+        self.writer = unicodecsv.writer(stream, encoding='utf-8')
+        self.writer.writerow(CSV_COLUMNS + ['details'])
+
+    def write(self, record):
+        details = dict((key, value) for key, value in record.items() if key not in CSV_COLUMNS)
+        row = [record.get(column) for column in CSV_COLUMNS]
+        row.append(json.dumps(details, default=str, sort_keys=True))
+        with self.lock:
+            self.writer.writerow(row)
+
+
+OUTPUT_WRITERS = {'jsonl': JsonLinesWriter,
+                  'csv': CsvWriter,
+                  'msgpack': MsgpackWriter}
+
+
+class SnapshotWriter(JsonLinesWriter):
+    """Write records as JSON lines with sorted keys, equal records having equal lines"""
+
+    def encode(self, record):
+        return json.dumps(record, default=str, sort_keys=True) + '\n'
+
+
+def snapshot_scope(config):
+    """Return the record heading a snapshot: the resources it has and their filters"""
+    shown, _ = select_resources(config.get('only'), config.get('exclude'), config.get('deep_stacks'))
+    return {'resource': 'scope', 'resources': sorted(shown), 'filters': config.get('filters') or {}}
+
+
+def read_scope(path):
+    """Return the scope record of a snapshot, None for the snapshots without one"""
+    with open(path) as f:
+        for _, record in read_snapshot(f):
+            return record if record.get('resource') == 'scope' else None
+
+
+def scope_differences(old_scope, new_scope):
+    """Return the resources listed or filtered differently in two snapshots, none when a scope is unknown"""
+    if old_scope is None or new_scope is None:
+        return set()
+
+    def scope(snapshot, resource):
+        return resource in snapshot['resources'], snapshot['filters'].get(resource)
+
+    differences = set(resource for resource in set(old_scope['resources']) | set(new_scope['resources'])
+                      if scope(old_scope, resource) != scope(new_scope, resource))
+    if 'security_groups' in differences:
+        differences.add('security_group_rules')
+    return differences
+
+
+def read_snapshot(f):
+    """Yield the offset and record of each line of a snapshot file"""
+    while True:
+        offset = f.tell()
+        line = f.readline()
+        if not line:
+            return
+        yield offset, json.loads(line)
+
+
+def snapshot_entries(record):
+    """Yield the key and content of the entries of a snapshot record
+
+    The rules of a security group are entries of their own, keyed by the
+    group and their fields, so that a rule shows as added or removed.
+    """
+    resource = record.get('resource')
+    if resource in ('changes', 'incomplete', 'scope'):
+        return
+    target = (record.get('project'), record.get('region'))
+    record_id = record.get('id') or record.get('name')
+    if resource == 'security_groups':
+        for rule in record.pop('rules', None) or []:
+            rule_id = '%s %s %s-%s %s' % (record_id, rule.get('protocol'), rule.get('from_port'),
+                                          rule.get('to_port'), rule.get('ip_range'))
+            yield target + ('security_group_rules', rule_id), dict(rule, resource='security_group_rules',
+                                                                   id=rule_id, name=record.get('name'),
+                                                                   project=target[0], region=target[1])
+    yield target + (resource, record_id), record
+
+
+def incomplete_resources(record):
+    """Return the project, region and resource of the entries an incomplete record makes uncertain"""
+    target = (record.get('project'), record.get('region'))
+    resources = set((record.get('name'),) + FETCH_RESOURCES.get(record.get('name'), ()))
+    if 'security_groups' in resources:
+        resources.add('security_group_rules')
+    return set(target + (resource,) for resource in resources)
+
+
+def entry_digest(entry):
+    return hashlib.sha1(json.dumps(entry, default=str, sort_keys=True)).digest()
+
+
+def diff_snapshots(old_path, new_path, resources=DIFF_RESOURCES):
+    """Yield the entries added, removed or changed between two snapshots
+
+    The old snapshot is indexed by key, with the digest and the offset of
+    each entry, then the new snapshot is streamed against the index: time
+    and memory are linear in the number of entries, and added and changed
+    entries are yielded as they are read. Removed entries come last.
+
+    An entry missing from a snapshot where its section is incomplete may
+    not have been listed: it is yielded as 'incomplete' instead of 'added'
+    or 'removed'. The resources listed or filtered differently in the two
+    snapshots are not compared (see scope_differences).
+    """
+    skipped = scope_differences(read_scope(old_path), read_scope(new_path))
+
+    def wanted(key):
+        return (not resources or key[2] in resources) and key[2] not in skipped
+
+    def old_entry(offset, key):
+        old.seek(offset)
+        return dict(snapshot_entries(json.loads(old.readline())))[key]
+
+    def change(kind, entry, fields=None):
+        result = {'resource': entry['resource'], 'change': kind, 'id': entry.get('id'),
+                  'name': entry.get('name'), 'project': entry.get('project'), 'region': entry.get('region')}
+        if fields:
+            result['fields'] = fields
+        return result
+
+    # Project, region and resource of the sections incomplete in each snapshot
+    old_incomplete = set()
+    new_incomplete = set()
+    index = {}
+    with open(old_path) as old:
+        for offset, record in read_snapshot(old):
+            if record.get('resource') == 'incomplete':
+                old_incomplete |= incomplete_resources(record)
+            for key, entry in snapshot_entries(record):
+                if wanted(key):
+                    index[key] = (entry_digest(entry), offset)
+
+        with open(new_path) as new:
+            for offset, record in read_snapshot(new):
+                if record.get('resource') == 'incomplete':
+                    new_incomplete |= incomplete_resources(record)
+                for key, entry in snapshot_entries(record):
+                    if not wanted(key):
+                        continue
+                    old_digest, old_offset = index.pop(key, (None, None))
+                    if old_digest is None:
+                        yield change('incomplete' if key[:3] in old_incomplete else 'added', entry)
+                    elif old_digest != entry_digest(entry):
+                        previous = old_entry(old_offset, key)
+                        fields = dict((field, [previous.get(field), entry.get(field)])
+                                      for field in set(previous) | set(entry)
+                                      if previous.get(field) != entry.get(field))
+                        yield change('changed', entry, fields)
+
+        for key, (_, offset) in sorted(index.items(), key=lambda item: item[1][1]):
+            yield change('incomplete' if key[:3] in new_incomplete else 'removed', old_entry(offset, key))
+
+
+def latest_snapshots(directory=SNAPSHOT_DIR, count=2):
+    """Return the paths of the latest snapshots of a directory, oldest first"""
+    try:
+        names = sorted(name for name in os.listdir(directory) if name.endswith('.jsonl'))
+    except OSError as e:
+        names = []
+    return [os.path.join(directory, name) for name in names[-count:]]
+
+
+def format_fields(fields):
+    return '; '.join('%s: %s -> %s' % (field, old, new) for field, (old, new) in sorted(fields.items()))
+
+
+def diff_command(argv):
+    parser = argparse.ArgumentParser(prog='osinventory.py diff',
+                                     description='Print the resources added, removed or changed '
+                                     'between two inventory snapshots')
+    parser.add_argument('old', help='older snapshot (default: the latest but one of %s)' % SNAPSHOT_DIR,
+                        nargs='?', default=None)
+    parser.add_argument('new', help='newer snapshot (default: the latest of %s)' % SNAPSHOT_DIR,
+                        nargs='?', default=None)
+    parser.add_argument('--resources', help='comma separated resources to compare, or all '
+                        '(default: %s)' % ','.join(DIFF_RESOURCES),
+                        default=','.join(DIFF_RESOURCES),
+                        required=False)
+    parser.add_argument('--output-format', help='table, or changes as JSON lines, CSV or msgpack',
+                        choices=['table'] + sorted(OUTPUT_WRITERS), default='table',
+                        required=False)
+    parser.add_argument('-o', '--output', help='write the changes to this file instead of '
+                        'the standard output',
+                        default=None,
+                        required=False)
+    args = parser.parse_args(argv)
+
+    if args.old is None:
+        snapshots = latest_snapshots()
+        if len(snapshots) < 2:
+            parser.error('less than two snapshots in %s, run osinventory.py --snapshot' % SNAPSHOT_DIR)
+    elif args.new is None:
+        parser.error('give the new snapshot to compare %s with' % args.old)
+    else:
+        snapshots = [args.old, args.new]
+    resources = None if args.resources == 'all' else set(args.resources.split(','))
+
+    output = open(args.output, 'wb') if args.output else sys.stdout
+    try:
+        changes = diff_snapshots(snapshots[0], snapshots[1], resources)
+        if args.output_format != 'table':
+            writer = OUTPUT_WRITERS[args.output_format](output)
+            for change in changes:
+                writer.write(change)
+            return
+        diff_table = prettytable.PrettyTable(['Project', 'Region', 'Resource', 'Change', 'ID', 'Name', 'Fields'])
+        diff_table.align['Fields'] = 'l'
+        for change in changes:
+            diff_table.add_row([change['project'], change['region'], change['resource'], change['change'],
+                                change['id'], or_dash(change['name']), format_fields(change.get('fields', {}))])
+        print >>output, '\nChanges from %s to %s\n' % tuple(snapshots)
+        print >>output, diff_table
+        skipped = scope_differences(read_scope(snapshots[0]), read_scope(snapshots[1]))
+        if skipped:
+            print >>output, '\nNot compared, listed or filtered differently: %s\n' % ', '.join(sorted(skipped))
+    finally:
+        if output is not sys.stdout:
+            output.close()
 
 
 def format_network(name, liste):
@@ -75,559 +1571,2030 @@ def format_network(name, liste):
         pass
 
 
+def as_dict(row):
+    """Return a row of the APIs, a dict or a client resource, as a dict"""
+    if isinstance(row, dict):
+        return row
+    return row.to_dict()
+
+
+def or_dash(value):
+    return '-' if value is None else value
+
+
+def cell_text(value):
+    """Return a value as prettytable shows it, in unicode"""
+    if isinstance(value, unicode):
+        return value
+    if not isinstance(value, str):
+        value = str(value)
+    return unicode(value, 'utf-8')
+
+
+def display_width(text):
+    """Return the columns a line of text takes on a terminal, wide characters taking two, like prettytable"""
+    return prettytable._str_block_width(text)
+
+
+class StreamingTable(object):
+    """Table of a large section, written row by row like a prettytable
+
+    The columns are sized from the first sample rows, and at least to the
+    widths of hints when there are more rows, so the lines are written as
+    the rows are read, without rendering the whole table first. A later
+    cell wider than its column is written whole, shifting the rest of its
+    row. A cell of several lines takes as many lines of the table. A table
+    of sample rows or less looks like its prettytable.
+    """
+
+    def __init__(self, columns, rows, sample=STREAM_SAMPLE, hints=WIDTH_HINTS):
+        self.columns = columns
+        self.rows = rows
+        self.sample = sample
+        self.hints = hints
+
+    def widths(self):
+        widths = [display_width(column) for column in self.columns]
+        if len(self.rows) > self.sample:
+            widths = [max(width, self.hints.get(column, 0)) for width, column in zip(widths, self.columns)]
+        for row in itertools.islice(self.rows, self.sample):
+            widths = [max([width] + [display_width(line) for line in cell_text(value).split(u'\n')])
+                      for width, value in zip(widths, row)]
+        return widths
+
+    @staticmethod
+    def center(text, width):
+        """Center text in width like prettytable, odd lengths leaning left"""
+        length = display_width(text)
+        excess = width - length
+        left = excess // 2
+        if excess % 2 and not length % 2:
+            left += 1
+        return ' ' * left + text + ' ' * (excess - left)
+
+    def lines(self):
+        """Yield the lines of the table, encoded in UTF-8"""
+        widths = self.widths()
+        rule = '+' + '+'.join('-' * (width + 2) for width in widths) + '+'
+
+        def lines(values):
+            # The lines of the cells, at the top of the row
+            cells = [cell_text(value).split(u'\n') for value in values]
+            for y in range(max(len(cell) for cell in cells)):
+                yield (u'| ' + u' | '.join(self.center(cell[y] if y < len(cell) else u'', width)
+                                           for cell, width in zip(cells, widths)) + u' |').encode('utf-8')
+
+        yield rule
+        for line in lines(self.columns):
+            yield line
+        yield rule
+        for row in self.rows:
+            for line in lines(row):
+                yield line
+        yield rule
+
+    def write(self, streams):
+        for text in self.lines():
+            for stream in streams:
+                print >>stream, text
+
+
+class Record(object):
+    """Compact record of an inventoried resource
+
+    The fields of a resource type are the slots of its record class, in
+    the order of the constructor arguments. from_row builds a record from
+    a row of the APIs, reading its api_fields only: the APIs which can
+    project their rows are asked for these fields alone, None being all.
+    """
+    __slots__ = fields = ()
+    resource = None
+    api_fields = None
+
+    def __init__(self, *values):
+        for name, value in zip(self.fields, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def from_row(cls, row):
+        data = as_dict(row)
+        return cls(*[data.get(name) for name in cls.fields])
+
+    def to_dict(self):
+        record = dict((name, getattr(self, name)) for name in self.fields)
+        record['resource'] = self.resource
+        return record
+
+
+class Limit(Record):
+    __slots__ = fields = ('name', 'max', 'used')
+    resource = 'limits'
+
+
+class Server(Record):
+    __slots__ = fields = ('id', 'name', 'status', 'image_id', 'flavor_id', 'key_name', 'addresses')
+    resource = 'servers'
+
+    @classmethod
+    def from_row(cls, row):
+        data = as_dict(row)
+        addresses = tuple((network, tuple(address['addr'] for address in network_addresses))
+                          for network, network_addresses in (data.get('addresses') or {}).items())
+        return cls(data['id'], data.get('name'), data.get('status'),
+                   (data.get('image') or {}).get('id'), (data.get('flavor') or {}).get('id'),
+                   data.get('key_name'), addresses)
+
+    def to_dict(self):
+        record = Record.to_dict(self)
+        record['addresses'] = dict(self.addresses)
+        return record
+
+
+class Flavor(Record):
+    __slots__ = fields = ('id', 'name', 'vcpus', 'ram', 'disk')
+    resource = 'flavors'
+
+    @property
+    def details(self):
+        return format_flavor_details({'vcpus': self.vcpus, 'ram': self.ram, 'disk': self.disk})
+
+
+class FloatingIP(Record):
+    __slots__ = fields = ('id', 'ip', 'fixed_ip', 'instance_id', 'pool')
+    resource = 'floating_ips'
+
+
+class KeyPair(Record):
+    __slots__ = fields = ('name', 'fingerprint')
+    resource = 'keypairs'
+
+    @classmethod
+    def from_row(cls, row):
+        data = as_dict(row)
+        data = data.get('keypair', data)
+        return cls(data.get('name'), data.get('fingerprint'))
+
+
+SecurityGroupRule = collections.namedtuple('SecurityGroupRule',
+                                           ['protocol', 'from_port', 'to_port', 'ip_range'])
+
+
+class SecurityGroup(Record):
+    __slots__ = fields = ('id', 'name', 'description', 'rules')
+    resource = 'security_groups'
+
+    @classmethod
+    def from_row(cls, row):
+        data = as_dict(row)
+        rules = tuple(SecurityGroupRule(rule.get('ip_protocol'), rule.get('from_port'), rule.get('to_port'),
+                                        (rule.get('ip_range') or {}).get('cidr'))
+                      for rule in filter(None, data.get('rules') or []))
+        return cls(data.get('id'), data.get('name'), data.get('description'), rules)
+
+    def to_dict(self):
+        record = Record.to_dict(self)
+        record['rules'] = [dict(rule._asdict()) for rule in self.rules]
+        return record
+
+
+class Image(Record):
+    __slots__ = fields = ('id', 'name', 'status', 'size', 'disk_format', 'created_at',
+                          'category', 'snapshot')
+    resource = 'images'
+
+    @classmethod
+    def from_row(cls, row, project):
+        data = as_dict(row)
+        properties = data.get('properties') or {}
+        return cls(data['id'], data.get('name'), data.get('status'), data.get('size'),
+                   data.get('disk_format'), data.get('created_at'),
+                   get_image_category(data, project, properties), properties.get('image_type') == 'snapshot')
+
+
+class Volume(Record):
+    __slots__ = fields = ('id', 'name', 'status', 'size', 'volume_type', 'bootable', 'server_ids',
+                          'snapshot_id', 'created_at')
+    resource = 'volumes'
+
+    @classmethod
+    def from_row(cls, row):
+        data = as_dict(row)
+        return cls(data['id'], data.get('name'), data.get('status'), data.get('size'),
+                   data.get('volume_type'), data.get('bootable'),
+                   tuple(attachment['server_id'] for attachment in data.get('attachments') or []),
+                   data.get('snapshot_id'), data.get('created_at'))
+
+    def to_dict(self):
+        record = Record.to_dict(self)
+        record['server_ids'] = list(self.server_ids)
+        return record
+
+
+class VolumeSnapshot(Record):
+    __slots__ = fields = ('id', 'name', 'status', 'description', 'size', 'volume_id', 'created_at')
+    resource = 'volume_snapshots'
+
+
+class VolumeBackup(VolumeSnapshot):
+    __slots__ = ()
+    resource = 'volume_backups'
+
+
+class Network(Record):
+    __slots__ = fields = ('id', 'name', 'status', 'subnet_ids', 'external')
+    resource = 'networks'
+    api_fields = ('id', 'name', 'status', 'subnets', 'router:external')
+
+    @classmethod
+    def from_row(cls, row):
+        data = as_dict(row)
+        return cls(data['id'], data.get('name'), data.get('status'), tuple(data.get('subnets') or ()),
+                   data.get('router:external'))
+
+    def to_dict(self):
+        record = Record.to_dict(self)
+        record['subnet_ids'] = list(self.subnet_ids)
+        return record
+
+
+class Subnet(Record):
+    __slots__ = fields = ('id', 'name', 'network_id', 'allocation_pools', 'gateway_ip', 'cidr')
+    resource = 'subnets'
+    api_fields = fields
+
+
+class Router(Record):
+    __slots__ = fields = ('id', 'name', 'status', 'network_id')
+    resource = 'routers'
+    api_fields = ('id', 'name', 'status', 'external_gateway_info')
+
+    @classmethod
+    def from_row(cls, row):
+        data = as_dict(row)
+        return cls(data['id'], data.get('name'), data.get('status'),
+                   (data.get('external_gateway_info') or {}).get('network_id'))
+
+
+class Pool(Record):
+    __slots__ = fields = ('id', 'name', 'status', 'provider', 'lb_method', 'admin_state_up', 'protocol')
+    resource = 'lbaas_pools'
+    api_fields = fields
+
+
+class Member(Record):
+    __slots__ = fields = ('id', 'pool_id', 'status', 'address', 'protocol_port')
+    resource = 'lbaas_members'
+    api_fields = fields
+
+
+class LoadBalancer(Record):
+    __slots__ = fields = ('id', 'name', 'vip_address', 'provisioning_status', 'operating_status', 'provider')
+    resource = 'loadbalancers'
+    api_fields = fields
+
+
+class Listener(Record):
+    __slots__ = fields = ('id', 'name', 'protocol', 'protocol_port', 'loadbalancer_ids', 'default_pool_id')
+    resource = 'listeners'
+    api_fields = ('id', 'name', 'protocol', 'protocol_port', 'loadbalancers', 'default_pool_id')
+
+    @classmethod
+    def from_row(cls, row):
+        data = as_dict(row)
+        return cls(data['id'], data.get('name'), data.get('protocol'), data.get('protocol_port'),
+                   tuple(loadbalancer['id'] for loadbalancer in data.get('loadbalancers') or []),
+                   data.get('default_pool_id'))
+
+    def to_dict(self):
+        record = Record.to_dict(self)
+        record['loadbalancer_ids'] = list(self.loadbalancer_ids)
+        return record
+
+
+class LbaasPool(Record):
+    __slots__ = fields = ('id', 'name', 'protocol', 'lb_algorithm', 'admin_state_up', 'loadbalancer_ids',
+                          'healthmonitor_id')
+    resource = 'lbaas_v2_pools'
+    # The members tell which pools to list the members of
+    api_fields = ('id', 'name', 'protocol', 'lb_algorithm', 'admin_state_up', 'loadbalancers', 'healthmonitor_id',
+                  'members')
+
+    @classmethod
+    def from_row(cls, row):
+        data = as_dict(row)
+        return cls(data['id'], data.get('name'), data.get('protocol'), data.get('lb_algorithm'),
+                   data.get('admin_state_up'),
+                   tuple(loadbalancer['id'] for loadbalancer in data.get('loadbalancers') or []),
+                   data.get('healthmonitor_id'))
+
+    def to_dict(self):
+        record = Record.to_dict(self)
+        record['loadbalancer_ids'] = list(self.loadbalancer_ids)
+        return record
+
+
+class LbaasMember(Record):
+    __slots__ = fields = ('id', 'pool_id', 'address', 'protocol_port', 'weight', 'operating_status',
+                          'admin_state_up')
+    resource = 'lbaas_v2_members'
+    # The pool is added to the rows, listed by pool
+    api_fields = fields[:1] + fields[2:]
+
+
+class HealthMonitor(Record):
+    __slots__ = fields = ('id', 'type', 'delay', 'timeout', 'max_retries', 'url_path')
+    resource = 'healthmonitors'
+    api_fields = fields
+
+    @property
+    def details(self):
+        details = '%s every %ss, %s retries' % (self.type, self.delay, self.max_retries)
+        if self.url_path:
+            details += ', ' + self.url_path
+        return details
+
+
+class Stack(Record):
+    __slots__ = fields = ('id', 'name', 'status', 'creation_time', 'status_reason')
+    resource = 'stacks'
+
+    @classmethod
+    def from_row(cls, row):
+        data = as_dict(row)
+        return cls(data.get('id'), data.get('stack_name'), data.get('stack_status'),
+                   data.get('creation_time'), data.get('stack_status_reason'))
+
+
+class NestedStack(Stack):
+    __slots__ = ('parent_id',)
+    fields = Stack.fields + ('parent_id',)
+    resource = 'nested_stacks'
+
+    @classmethod
+    def from_row(cls, row):
+        data = as_dict(row)
+        return cls(data.get('id'), data.get('stack_name'), data.get('stack_status'),
+                   data.get('creation_time'), data.get('stack_status_reason'), data.get('parent'))
+
+
+class StackResource(Record):
+    __slots__ = fields = ('stack_id', 'name', 'type', 'status', 'physical_id', 'nested_stack_id')
+    resource = 'stack_resources'
+
+    @classmethod
+    def from_row(cls, row):
+        data = as_dict(row)
+        return cls(data['stack_id'], data.get('resource_name'), data.get('resource_type'),
+                   data.get('resource_status'), data.get('physical_resource_id') or None, nested_stack_id(data))
+
+
+class StackOutput(Record):
+    __slots__ = fields = ('stack_id', 'key', 'value', 'description')
+    resource = 'stack_outputs'
+
+    @classmethod
+    def from_row(cls, row):
+        data = as_dict(row)
+        return cls(data['stack_id'], data.get('output_key'), data.get('output_value'), data.get('description'))
+
+
+def build_records(record_class, rows):
+    return [record_class.from_row(row) for row in rows]
+
+
+class lazy_property(object):
+    """A property computed on first use under the lock of the instance, then kept as an attribute"""
+
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        with instance.lock:
+            if self.__name__ not in instance.__dict__:
+                instance.__dict__[self.__name__] = self.func(instance)
+            return instance.__dict__[self.__name__]
+
+
+class Inventory(object):
+    """Records of a project, with the references between them indexed
+
+    Renderers read the inventory only: the servers of volumes, the flavor
+    and image of servers, the subnets and gateways of networks and the
+    members of pools are looked up in the indexes.
+
+    The records of a resource can be deferred, to be built from its rows
+    when they are first read, and the indexes are built when first used:
+    a section is rendered as soon as its listings are retrieved, while the
+    listings of the next sections are still running.
+    """
+    RESOURCES = ('limits', 'servers', 'flavors', 'floating_ips', 'keypairs', 'security_groups', 'images',
+                 'volumes', 'volume_snapshots', 'volume_backups', 'networks', 'subnets', 'routers',
+                 'lbaas_pools', 'lbaas_members', 'loadbalancers', 'listeners', 'lbaas_v2_pools',
+                 'lbaas_v2_members', 'healthmonitors', 'stacks', 'nested_stacks', 'stack_resources',
+                 'stack_outputs')
+
+    def __init__(self, servers_by_id=None):
+        self.lock = threading.RLock()
+        # Build the records of the resources deferred
+        self.sources = {}
+        self.limits = []
+        self.servers = []
+        self.flavors = []
+        self.floating_ips = []
+        self.keypairs = []
+        self.security_groups = []
+        self.images = []
+        self.volumes = []
+        self.volume_snapshots = []
+        self.volume_backups = []
+        self.networks = []
+        self.subnets = []
+        self.routers = []
+        self.lbaas_pools = []
+        self.lbaas_members = []
+        self.loadbalancers = []
+        self.listeners = []
+        self.lbaas_v2_pools = []
+        self.lbaas_v2_members = []
+        self.healthmonitors = []
+        self.stacks = []
+        self.nested_stacks = []
+        self.stack_resources = []
+        self.stack_outputs = []
+        # Images and servers the filters leave out of their sections, which
+        # servers and volumes may still use
+        self.filtered_images = []
+        self.filtered_servers = []
+        # Also has the servers of other projects attached to volumes, added
+        # when the servers are built
+        self.servers_by_id = {} if servers_by_id is None else servers_by_id
+
+    def defer(self, resource, load):
+        """Build the records of resource with load() when they are first read"""
+        self.sources[resource] = load
+        self.__dict__.pop(resource, None)
+
+    def __getattr__(self, name):
+        # Called for the resources deferred, which are not attributes yet
+        with self.__dict__['lock']:
+            if name in self.__dict__:
+                return self.__dict__[name]
+            load = self.__dict__['sources'].pop(name, None)
+            if load is None:
+                raise AttributeError(name)
+            setattr(self, name, [])
+            setattr(self, name, load())
+            return self.__dict__[name]
+
+    def load(self):
+        """Build the resources deferred, before the inventory is read by other threads"""
+        for resource in self.RESOURCES:
+            getattr(self, resource)
+
+    @lazy_property
+    def flavors_by_id(self):
+        return dict((flavor.id, flavor) for flavor in self.flavors)
+
+    @lazy_property
+    def images_by_id(self):
+        images = self.images
+        return dict((image.id, image) for image in images + self.filtered_images)
+
+    @lazy_property
+    def images_by_category(self):
+        """Positions of the images of each category, and of the snapshots"""
+        images_by_category = collections.defaultdict(list)
+        for position, image in enumerate(self.images):
+            images_by_category[image.category].append(position)
+            if image.snapshot:
+                images_by_category['snapshot'].append(position)
+        return images_by_category
+
+    @lazy_property
+    def subnets_by_id(self):
+        return dict((subnet.id, subnet) for subnet in self.subnets)
+
+    @lazy_property
+    def gateways_by_network(self):
+        gateways_by_network = collections.defaultdict(list)
+        for router in self.routers:
+            gateways_by_network[router.network_id].append(router)
+        return gateways_by_network
+
+    @lazy_property
+    def members_by_pool(self):
+        members_by_pool = collections.defaultdict(list)
+        for member in self.lbaas_members + self.lbaas_v2_members:
+            members_by_pool[member.pool_id].append(member)
+        return members_by_pool
+
+    @lazy_property
+    def listeners_by_loadbalancer(self):
+        listeners_by_loadbalancer = collections.defaultdict(list)
+        for listener in self.listeners:
+            for loadbalancer_id in listener.loadbalancer_ids:
+                listeners_by_loadbalancer[loadbalancer_id].append(listener)
+        return listeners_by_loadbalancer
+
+    @lazy_property
+    def loadbalancers_by_id(self):
+        return dict((loadbalancer.id, loadbalancer) for loadbalancer in self.loadbalancers)
+
+    @lazy_property
+    def healthmonitors_by_id(self):
+        return dict((monitor.id, monitor) for monitor in self.healthmonitors)
+
+    @lazy_property
+    def stacks_by_id(self):
+        return dict((stack.id, stack) for stack in self.stacks + self.nested_stacks)
+
+    @lazy_property
+    def records_by_id(self):
+        """Records the stack resources are, of the resources inventoried"""
+        if not self.stack_resources:
+            return {}
+        records_by_id = dict((resource, dict((record.id, record) for record in getattr(self, resource)))
+                             for resource, _ in STACK_RESOURCE_TYPES.values())
+        records_by_id['servers'] = self.servers_by_id
+        return records_by_id
+
+    def flavor(self, server):
+        return self.flavors_by_id.get(server.flavor_id)
+
+    def image(self, server):
+        return self.images_by_id.get(server.image_id)
+
+    def image_view(self, rows, category):
+        """Return the rows of the images of a category, rows being those of all the images"""
+        return [rows[position] for position in self.images_by_category.get(category, ())]
+
+    def attached_servers(self, volume):
+        return [self.servers_by_id[server_id] for server_id in volume.server_ids
+                if server_id in self.servers_by_id]
+
+    def subnets_of(self, network):
+        return [self.subnets_by_id[subnet_id] for subnet_id in network.subnet_ids
+                if subnet_id in self.subnets_by_id]
+
+    def gateways_of(self, network):
+        return self.gateways_by_network.get(network.id, [])
+
+    def members_of(self, pool):
+        return self.members_by_pool.get(pool.id, [])
+
+    def listeners_of(self, loadbalancer):
+        return self.listeners_by_loadbalancer.get(loadbalancer.id, [])
+
+    def loadbalancers_of(self, pool):
+        return [self.loadbalancers_by_id[loadbalancer_id] for loadbalancer_id in pool.loadbalancer_ids
+                if loadbalancer_id in self.loadbalancers_by_id]
+
+    def healthmonitor(self, pool):
+        return self.healthmonitors_by_id.get(pool.healthmonitor_id)
+
+    def stack_name(self, stack_id):
+        stack = self.stacks_by_id.get(stack_id)
+        return stack.name if stack else stack_id
+
+    def stack_target(self, resource):
+        """Return the label and record of what a stack resource is, None if it is not inventoried"""
+        if resource.nested_stack_id:
+            stack = self.stacks_by_id.get(resource.nested_stack_id)
+            return stack and ('Stack', stack)
+        target, label = STACK_RESOURCE_TYPES.get(resource.type, (None, None))
+        record = self.records_by_id.get(target, {}).get(resource.physical_id)
+        return record and (label, record)
+
+
+def select_resources(only=None, exclude=None, deep_stacks=False):
+    """Return the resources shown by the selectors, and the fetches needed to show them
+
+    The resources of the deep stack fetch are shown by default with deep_stacks only.
+    """
+    default = Inventory.RESOURCES if deep_stacks else [resource for resource in Inventory.RESOURCES
+                                                       if resource not in DEEP_STACK_RESOURCES]
+    shown = set(only or default) - set(exclude or ())
+    needed = shown | set(need for resource in shown for need in SECTION_NEEDS.get(resource, ()))
+    return shown, set(RESOURCE_FETCHES[resource] for resource in needed)
+
+
+# Record class of each resource, a table of the store
+STORE_RECORDS = collections.OrderedDict((record_class.resource, record_class) for record_class in (
+    Limit, Server, Flavor, FloatingIP, KeyPair, SecurityGroup, Image, Volume, VolumeSnapshot, VolumeBackup,
+    Network, Subnet, Router, Pool, Member, LoadBalancer, Listener, LbaasPool, LbaasMember, HealthMonitor, Stack,
+    NestedStack, StackResource, StackOutput))
+
+# Queries of the query command: description and SQL, with project and region columns
+QUERIES = collections.OrderedDict([
+    ('unattached-volumes', ('volumes not attached to any server', """
+        SELECT v.project, v.region, v.id, v.name, v.status, v.size, v.volume_type, v.created_at
+        FROM volumes v
+        WHERE NOT EXISTS (SELECT 1 FROM volume_attachments a
+                          WHERE a.volume_id = v.id AND a.project = v.project AND a.region = v.region)
+        ORDER BY v.project, v.region, v.created_at""")),
+    ('servers-per-flavor', ('number of servers of each flavor', """
+        SELECT s.project, s.region, s.flavor_id, f.name AS flavor, f.vcpus, f.ram, f.disk, COUNT(*) AS servers
+        FROM servers s
+        LEFT JOIN flavors f ON f.id = s.flavor_id AND f.project = s.project AND f.region = s.region
+        GROUP BY s.project, s.region, s.flavor_id
+        ORDER BY s.project, s.region, servers DESC""")),
+    ('servers-per-image', ('number of servers of each image', """
+        SELECT s.project, s.region, s.image_id, i.name AS image, COUNT(*) AS servers
+        FROM servers s
+        LEFT JOIN images i ON i.id = s.image_id AND i.project = s.project AND i.region = s.region
+        GROUP BY s.project, s.region, s.image_id
+        ORDER BY s.project, s.region, servers DESC""")),
+    ('unused-floating-ips', ('floating IPs not associated to a server', """
+        SELECT project, region, id, ip, pool
+        FROM floating_ips
+        WHERE fixed_ip IS NULL OR instance_id IS NULL
+        ORDER BY project, region, ip""")),
+    ('stack-resources', ('resources of the stacks, with the servers, volumes, networks and nested '
+                         'stacks they are', """
+        SELECT r.project, r.region, COALESCE(s.name, n.name) AS stack, r.name AS resource, r.type,
+               r.physical_id, COALESCE(sv.name, v.name, net.name, nested.name) AS inventoried_as
+        FROM stack_resources r
+        LEFT JOIN stacks s ON s.id = r.stack_id AND s.project = r.project AND s.region = r.region
+        LEFT JOIN nested_stacks n ON n.id = r.stack_id AND n.project = r.project AND n.region = r.region
+        LEFT JOIN servers sv ON sv.id = r.physical_id AND sv.project = r.project AND sv.region = r.region
+        LEFT JOIN volumes v ON v.id = r.physical_id AND v.project = r.project AND v.region = r.region
+        LEFT JOIN networks net ON net.id = r.physical_id AND net.project = r.project AND net.region = r.region
+        LEFT JOIN nested_stacks nested ON nested.id = r.nested_stack_id AND nested.project = r.project
+                                          AND nested.region = r.region
+        ORDER BY r.project, r.region, stack, r.name""")),
+    ('stored', ('resources stored for each project and region, and when', """
+        SELECT project, region, resource, rows, stored_at
+        FROM stored
+        ORDER BY project, region, resource"""))])
+
+
+def store_value(value):
+    """Return a field of a record as stored, lists and dicts in JSON"""
+    if isinstance(value, (list, tuple, dict)):
+        return json.dumps(value, default=str)
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    if value is None or isinstance(value, (unicode, int, long, float)):
+        return value
+    return unicode(value)
+
+
+class InventoryStore(object):
+    """SQLite store of the inventories of projects and regions
+
+    Each resource has a table of the fields of its records, with their
+    project and region, and volume_attachments links volumes and servers.
+    The ids, names, statuses, projects and STORE_REFERENCES are indexed.
+    The rows of a resource of a project are replaced whole when it is
+    saved, and the stored table tells when.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        if not os.path.isdir(os.path.dirname(path) or '.'):
+            os.makedirs(os.path.dirname(path), 0700)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.create()
+
+    @staticmethod
+    def tables():
+        """Return the columns of each table"""
+        tables = collections.OrderedDict((resource, ('project', 'region') + record_class.fields)
+                                         for resource, record_class in STORE_RECORDS.items())
+        tables['volume_attachments'] = ('project', 'region', 'volume_id', 'server_id')
+        return tables
+
+    def create(self):
+        with self.connection:
+            if self.connection.execute('PRAGMA user_version').fetchone()[0] != STORE_VERSION:
+                for (table,) in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'"
+                                                        ).fetchall():
+                    self.connection.execute('DROP TABLE "%s"' % table)
+                self.connection.execute('PRAGMA user_version = %d' % STORE_VERSION)
+            for table, columns in self.tables().items():
+                self.connection.execute('CREATE TABLE IF NOT EXISTS "%s" (%s)'
+                                        % (table, ', '.join('"%s"' % column for column in columns)))
+                indexed = [('project', 'region')] + [(column,) for column in ('id', 'name', 'status')
+                                                     if column in columns]
+                indexed += [(column,) for column in STORE_REFERENCES.get(table, ())]
+                for index_columns in indexed:
+                    self.connection.execute('CREATE INDEX IF NOT EXISTS "%s_%s" ON "%s" (%s)'
+                                            % (table, '_'.join(index_columns), table,
+                                               ', '.join('"%s"' % column for column in index_columns)))
+            self.connection.execute('CREATE TABLE IF NOT EXISTS stored (project, region, resource, rows, '
+                                    'stored_at, PRIMARY KEY (project, region, resource))')
+
+    def replace(self, table, project, region, rows):
+        self.connection.execute('DELETE FROM "%s" WHERE project = ? AND region = ?' % table, (project, region))
+        self.connection.executemany('INSERT INTO "%s" VALUES (%s)'
+                                    % (table, ', '.join('?' * len(self.tables()[table]))),
+                                    ([project, region] + [store_value(value) for value in row] for row in rows))
+
+    def save(self, project, region, inventory, resources):
+        """Replace the rows of resources of a project and region by those of its inventory, at once"""
+        stored_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        with self.connection:
+            for resource in resources:
+                records = getattr(inventory, resource)
+                fields = STORE_RECORDS[resource].fields
+                self.replace(resource, project, region,
+                             ([getattr(record, field) for field in fields] for record in records))
+                if resource == 'volumes':
+                    self.replace('volume_attachments', project, region,
+                                 ([volume.id, server_id] for volume in records for server_id in volume.server_ids))
+                self.connection.execute('INSERT OR REPLACE INTO stored VALUES (?, ?, ?, ?, ?)',
+                                        (project, region, resource, len(records), stored_at))
+
+    def query(self, sql, project=None, region=None):
+        """Return the columns and rows of a query, of a project and region if given"""
+        conditions = ['%s = ?' % column for column, value in (('project', project), ('region', region))
+                      if value is not None]
+        if conditions:
+            sql = 'SELECT * FROM (%s) WHERE %s' % (sql, ' AND '.join(conditions))
+        cursor = self.connection.execute(sql, [value for value in (project, region) if value is not None])
+        return [description[0] for description in cursor.description], cursor.fetchall()
+
+    def close(self):
+        self.connection.close()
+
+
+def query_command(argv):
+    parser = argparse.ArgumentParser(prog='osinventory.py query',
+                                     description='Answer questions about the inventories stored by '
+                                     'osinventory.py --store, without calling the APIs',
+                                     epilog='queries: %s' % '; '.join('%s: %s' % (name, description)
+                                                                      for name, (description, _)
+                                                                      in QUERIES.items()))
+    parser.add_argument('query', help='query to run',
+                        nargs='?', choices=list(QUERIES), default=None)
+    parser.add_argument('--sql', help='run this SQL query instead, the tables are named after '
+                        'the resources',
+                        default=None,
+                        required=False)
+    parser.add_argument('--store', help='SQLite store of the inventories (default: %s)' % STORE_PATH,
+                        default=STORE_PATH,
+                        required=False)
+    parser.add_argument('--project', help='rows of this project only',
+                        default=None,
+                        required=False)
+    parser.add_argument('--region', help='rows of this region only',
+                        default=None,
+                        required=False)
+    parser.add_argument('--output-format', help='table, or rows as JSON lines, CSV or msgpack',
+                        choices=['table'] + sorted(OUTPUT_WRITERS), default='table',
+                        required=False)
+    parser.add_argument('-o', '--output', help='write the rows to this file instead of '
+                        'the standard output',
+                        default=None,
+                        required=False)
+    args = parser.parse_args(argv)
+
+    if (args.query is None) == (args.sql is None):
+        parser.error('give either a query or --sql')
+    if not os.path.exists(args.store):
+        parser.error('no inventory stored in %s, run osinventory.py --store' % args.store)
+
+    store = InventoryStore(args.store)
+    try:
+        columns, rows = store.query(args.sql or QUERIES[args.query][1], args.project, args.region)
+    except sqlite3.Error as e:
+        parser.error('could not run the query: %s' % e)
+    finally:
+        store.close()
+
+    output = open(args.output, 'wb') if args.output else sys.stdout
+    try:
+        if args.output_format != 'table':
+            writer = OUTPUT_WRITERS[args.output_format](output)
+            for row in rows:
+                writer.write(dict(zip(columns, row)))
+            return
+        query_table = prettytable.PrettyTable(columns)
+        for row in rows:
+            query_table.add_row(row)
+        print >>output, query_table
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
 class OpenStackUtils():
     def __init__(self, config):
-        global sess
-        sess = session_create(config)
-        self.keystone_client = keystone.Client(username=config['username'],
-                                               password=config['password'],
-                                               tenant_id=config['project'],
-                                               auth_url=config['auth_url'],
-                                               region_name=config['region_name'])
-
-        heat_url = self.keystone_client \
-            .service_catalog.url_for(service_type='orchestration',
-                                     endpoint_type='publicURL')
-
-        self.nova_client = nova.Client('2.1', region_name=config['region_name'], session=sess)
-        self.cinder_client = cinder.Client('2', region_name=config['region_name'], session=sess)
-        self.glance_client = glance.Client('2', region_name=config['region_name'], session=sess)
-        self.neutron_client = neutron.Client(region_name=config['region_name'], session=sess)
-        self.heat_client = heat.Client('1', region_name=config['region_name'], endpoint=heat_url, session=sess)
-
-        functions = []
-        threads = []
-        self.print_servers = self.print_ips = self.print_scgps = self.print_keys = False
-        self.print_volumes = self.print_snapshots = self.print_backups = False
-        self.print_netowrks = self.print_routers = False
-        self.print_images = self.print_owned_images = self.print_shared_imges = False
-        self.print_cloudwatt_images = self.print_snapshots_images = False
-        self.print_lbaas_pools = self.print_members = self.print_stacks = False
+        self.config = config
+        self.profiler = Profiler() if config.get('profile') or config.get('profile_jsonl') else None
+        self.session = sess = session_create(config, self.profiler)
+
+        # Clients are created when a fetch first uses them
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+        self.shown, fetches = select_resources(config.get('only'), config.get('exclude'),
+                                               config.get('deep_stacks', False))
+        self.filters = config.get('filters') or {}
+        self.projection = config.get('projection', True)
+
+        self.delta = config.get('delta', False)
+        if config.get('cache', True):
+            self.cache = InventoryCache(config, dict(CACHE_TTLS, **config.get('cache_ttls', {})))
+        else:
+            self.cache = None
+
+        page_sizes = dict(PAGE_SIZES, **config.get('page_sizes', {}))
+        self.scheduler = FetchScheduler(config.get('fetch_workers', FETCH_WORKERS),
+                                        config.get('fetch_timeout', FETCH_TIMEOUT),
+                                        self.profiler)
+        # The sections the running fetches miss, published in incomplete
+        # with the inventory they build, under inventory_lock
+        self.incomplete = self.fetch_incomplete = {}
+        self.inventory_lock = threading.Lock()
+        self.servers_dict = {}
+        self.server_lookups = 0
+
+        # Left as is by fetchers which time out
+        self.nova_limits = self.cinder_limits = []
+        self.flavors = []
+        self.servers = self.ips = self.securitygps = self.keys = self.images = []
+        self.volumes = self.snapshots = self.backups = []
+        self.routers = self.networks = self.subnets = []
+        self.lbaas_pools = self.members = self.stacks = []
+        self.loadbalancers = self.listeners = self.lbaas_v2_pools = []
+        self.lbaas_v2_members = self.healthmonitors = []
+        self.nested_stacks = self.stack_resources = self.stack_outputs = []
+        # Aliases of the network extensions, None when unknown
+        self.network_extensions = None
 
         def get_limits():
             try:
-                self.nova_limits = self.nova_client.limits.get().to_dict()['absolute']
-                self.cinder_limits = self.cinder_client.limits.get().to_dict()['absolute']
+                self.nova_limits = self.cached_rows(
+                    'nova_limits', lambda: [self.nova_client.limits.get().to_dict()['absolute']])[0]
+                self.cinder_limits = self.cached_rows(
+                    'cinder_limits', lambda: [self.cinder_client.limits.get().to_dict()['absolute']])[0]
             except Exception as e:
                 self.nova_limits = self.cinder_limits = []
                 logging.error("Could not retrieve limits")
+                self.fetch_incomplete['limits'] = 'failed'
 
-        functions.append(get_limits)
+        self.scheduler.add('limits', get_limits)
 
         def get_servers():
             try:
-                self.flavors_dict = {}
-                self.servers = map(lambda x: x.to_dict(), self.nova_client.servers.list())
-                map(lambda x: self.flavors_dict.update({x.id: x}), self.nova_client.flavors.list())
+
+                def list_changes(since):
+                    return to_dicts(marker_pages(
+                        lambda **kwargs: self.nova_client.servers.list(search_opts={'changes-since': since},
+                                                                       **kwargs),
+                        page_sizes['compute']))
+
+                if self.filters.get('servers') and 'volumes' not in fetches:
+                    # With the volumes, all the servers are listed for their
+                    # attachments, and filtered when the inventory is built
+                    query = filter_query('servers', self.filters['servers'])
+                    pages = self.filtered('servers', to_dicts(marker_pages(
+                        lambda **kwargs: self.nova_client.servers.list(search_opts=query, **kwargs),
+                        page_sizes['compute'])))
+                else:
+                    pages = self.synced('servers',
+                                        to_dicts(marker_pages(self.nova_client.servers.list, page_sizes['compute'])),
+                                        list_changes, lambda row: row['status'] == 'DELETED')
+                self.servers = self.collection('servers', pages, "Could not retrieve list of servers")
             except Exception as e:
                 self.servers = []
                 logging.error("Could not retrieve list of servers")
+                self.fetch_incomplete['servers'] = 'failed'
+
+        self.scheduler.add('servers', get_servers)
 
-        functions.append(get_servers)
+        def get_flavors():
+            try:
+                self.flavors = self.cached_rows('flavors', self.nova_client.flavors.list)
+            except Exception as e:
+                self.flavors = []
+                logging.error("Could not retrieve list of flavors")
+                self.fetch_incomplete['flavors'] = 'failed'
+
+        self.scheduler.add('flavors', get_flavors)
+
+        def get_images(project_id=config['project']):
+            try:
+
+                def list_changes(since):
+                    return single_page(lambda: self.glance_client.images.list(
+                        filters={'changes-since': since}, page_size=page_sizes['image']))
+
+                if self.filters.get('images') and 'servers' not in fetches:
+                    # With the servers, all the images are listed for their
+                    # names, and filtered when the inventory is built
+                    query = filter_query('images', self.filters['images'])
+                    pages = self.filtered('images', single_page(lambda: self.glance_client.images.list(
+                        filters=query, page_size=page_sizes['image'])))
+                else:
+                    pages = self.synced('images',
+                                        single_page(lambda: self.glance_client.images.list(
+                                            page_size=page_sizes['image'])),
+                                        list_changes,
+                                        lambda row: row.get('deleted') or row.get('status') == 'deleted')
+                self.images = [row for page in pages for row in page]
+            except Exception as e:
+                self.images = []
+                logging.error("Could not retrieve list of images")
+                self.fetch_incomplete['images'] = 'failed'
+
+        self.scheduler.add('images', get_images)
 
         def get_floating_ips():
             try:
-                self.ips = self.nova_client.floating_ips.list()
+                self.ips = self.collection('floating_ips',
+                                           self.cached('floating_ips',
+                                                       single_page(self.nova_client.floating_ips.list)),
+                                           "Could not retrieve list of floating IPs")
             except Exception as e:
                 self.ips = []
                 logging.error("Could not retrieve list of floating IPs")
+                self.fetch_incomplete['floating_ips'] = 'failed'
 
-        functions.append(get_floating_ips)
+        self.scheduler.add('floating_ips', get_floating_ips)
 
         def get_securitygps():
             try:
-                self.securitygps = map(lambda x: x.to_dict(), self.nova_client \
-                                       .security_groups.list())
+                self.securitygps = map(lambda x: x.to_dict(),
+                                       self.cached_rows('security_groups', self.nova_client.security_groups.list))
             except Exception as e:
                 self.securitygps = []
                 logging.error("Could not retrieve list of security groups")
+                self.fetch_incomplete['security_groups'] = 'failed'
 
-        functions.append(get_securitygps)
+        self.scheduler.add('security_groups', get_securitygps)
 
         def get_keys():
             try:
-                self.keys = self.nova_client.keypairs.list()
+                self.keys = self.cached_rows('keypairs', self.nova_client.keypairs.list)
             except Exception as e:
                 self.keys = []
                 logging.error("Could not retrieve list of keys")
+                self.fetch_incomplete['keypairs'] = 'failed'
 
-        functions.append(get_keys)
-
-        def get_images(project_id=config['project']):
-            try:
-                self.images_dict = {}
-                self.images = []
-                for image in self.glance_client.images.list():
-                    self.images.append(image)
-                copy_images = self.images
-                map(lambda x: self.images_dict.update({x.id: x}), copy_images)
-            except Exception as e:
-                logging.error("Could not retrieve list of images")
-
-        functions.append(get_images)
+        self.scheduler.add('keypairs', get_keys)
 
         def get_volumes():
             try:
-                self.volumes = self.cinder_client.volumes.list()
+                if self.filters.get('volumes'):
+                    query = filter_query('volumes', self.filters['volumes'])
+                    pages = self.filtered('volumes', marker_pages(
+                        lambda **kwargs: self.cinder_client.volumes.list(search_opts=query, **kwargs),
+                        page_sizes['volume']))
+                else:
+                    # Not synced: cinder v2 ignores changes-since, the whole
+                    # list would be read anyway
+                    pages = self.cached('volumes', marker_pages(self.cinder_client.volumes.list,
+                                                                page_sizes['volume']))
+                self.volumes = self.collection('volumes', pages, "Could not retrieve list of volumes")
             except Exception as e:
                 self.volumes = []
                 logging.error("Could not retrieve list of volumes")
+                self.fetch_incomplete['volumes'] = 'failed'
 
-        functions.append(get_volumes)
+        self.scheduler.add('volumes', get_volumes)
 
         def get_volumes_snapshots():
             try:
-                self.snapshots = self.cinder_client.volume_snapshots.list()
+                # The summary of snapshots has all the fields of their records
+                self.snapshots = self.collection('volume_snapshots',
+                                                 self.cached('volume_snapshots', marker_pages(
+                                                     lambda **kwargs: self.cinder_client.volume_snapshots.list(
+                                                         detailed=not self.projection, **kwargs),
+                                                     page_sizes['volume'])),
+                                                 "Could not retrieve list of snapshots")
             except Exception as e:
                 self.snapshots = []
                 logging.error("Could not retrieve list of snapshots")
+                self.fetch_incomplete['volume_snapshots'] = 'failed'
 
-        functions.append(get_volumes_snapshots)
+        self.scheduler.add('volume_snapshots', get_volumes_snapshots)
 
         def get_volumes_backups():
             try:
-                self.backups = self.cinder_client.backups.list()
+                self.backups = self.collection('volume_backups',
+                                               self.cached('volume_backups',
+                                                           marker_pages(self.cinder_client.backups.list,
+                                                                        page_sizes['volume'])),
+                                               "Could not retrieve list of backups")
             except Exception as e:
                 self.backups = []
                 logging.error("Could not retrieve list of backups")
+                self.fetch_incomplete['volume_backups'] = 'failed'
 
-        functions.append(get_volumes_backups)
+        self.scheduler.add('volume_backups', get_volumes_backups)
 
         def get_networks():
             try:
-                self.routers = self.neutron_client.list_routers()['routers']
-                self.networks = self.neutron_client.list_networks()['networks']
-                self.subnets = self.neutron_client.list_subnets()['subnets']
+                self.routers, self.networks, self.subnets = [
+                    self.collection(resource,
+                                    self.cached(resource, neutron_pages(list_resources, resource,
+                                                                        page_sizes['network'],
+                                                                        **self.projected(record_class))),
+                                    "Could not retrieve list of networks")
+                    for list_resources, resource, record_class in (
+                        (self.neutron_client.list_routers, 'routers', Router),
+                        (self.neutron_client.list_networks, 'networks', Network),
+                        (self.neutron_client.list_subnets, 'subnets', Subnet))]
             except Exception as e:
                 self.routers = self.networks = self.subnets = []
                 logging.error("Could not retrieve list of networks")
+                self.fetch_incomplete['networks'] = 'failed'
 
-        functions.append(get_networks)
+        self.scheduler.add('networks', get_networks)
 
-        def get_lbaas():
+        def get_network_extensions():
             try:
-                self.lbaas_pools = self.neutron_client.list_pools()['pools']
-                self.members = self.neutron_client.list_members()['members']
+                self.network_extensions = set(
+                    extension['alias'] for extension in
+                    self.cached_rows('network_extensions',
+                                     lambda: self.neutron_client.list_extensions()['extensions']))
             except Exception as e:
-                self.lbaas_pools = self.members = []
-                logging.error("Could not retrieve lbaas information")
+                logging.error("Could not retrieve list of network extensions")
+                self.fetch_incomplete['network_extensions'] = 'failed'
 
-        functions.append(get_lbaas)
+        self.scheduler.add('network_extensions', get_network_extensions)
 
-        def get_stacks():
+        def get_lbaas():
+            if not self.has_network_extension('lbaas'):
+                return
             try:
-                self.stacks = self.heat_client.stacks.list()
+                self.lbaas_pools = self.cached_rows('lbaas_pools', lambda: self.neutron_client.list_pools(
+                    **self.projected(Pool))['pools'])
+                self.members = self.cached_rows('lbaas_members', lambda: self.neutron_client.list_members(
+                    **self.projected(Member))['members'])
             except Exception as e:
-                self.stacks = []
-                logging.error("Could not retrieve list of stacks")
-
-        functions.append(get_stacks)
-
-        for func in functions:
-            t = threading.Thread(name=func, target=func)
-            threads.append(t)
-            t.start()
-        for t in threads:
-            t.join()
+                self.lbaas_pools = self.members = []
+                logging.error("Could not retrieve lbaas information")
+                self.fetch_incomplete['lbaas'] = 'failed'
 
-    def print_ressources(self):
-        try:
-            # Print Limits and Quotas Usage
-            nova_limits = self.nova_limits
-            cinder_limits = self.cinder_limits
-            limits_table = prettytable.PrettyTable(['Resource', 'Max', 'Used'])
-            limits_table.add_row(['Servers', nova_limits['maxTotalInstances'],
-                                  nova_limits['totalInstancesUsed']])
-            limits_table.add_row(['Volumes', cinder_limits['maxTotalVolumes'],
-                                  cinder_limits['totalVolumesUsed']])
-            limits_table.add_row(['V_Snapshots', cinder_limits['maxTotalSnapshots'],
-                                  cinder_limits['totalSnapshotsUsed']])
-            limits_table.add_row(['V_Backups', cinder_limits['maxTotalBackups'],
-                                  cinder_limits['totalBackupsUsed']])
-
-            limits_table.add_row(['RAM (MB)', nova_limits['maxTotalRAMSize'],
-                                  nova_limits['totalRAMUsed']])
-            limits_table.add_row(['Cores', nova_limits['maxTotalCores'],
-                                  nova_limits['totalCoresUsed']])
-            limits_table.add_row(['VolumesGigabytes',
-                                  cinder_limits['maxTotalBackupGigabytes'],
-                                  cinder_limits['totalGigabytesUsed']])
-            limits_table.add_row(['BackupGigabyte',
-                                  cinder_limits['totalBackupGigabytesUsed'],
-                                  cinder_limits['totalBackupGigabytesUsed']])
-        except Exception as e:
-            pass
+        self.scheduler.add('lbaas', get_lbaas, depends=('network_extensions',))
 
-        # Print List of Servers
-        try:
-            columns = ['ID', 'Name', 'Status', 'Image Name', 'Flavor Details', 'Key Name', 'Networks']
-            servers_table = prettytable.PrettyTable(columns)
-            for s in self.servers:
-                self.print_networks = True
-                networks = ''
-                if s['addresses']:
-                    networks = s['addresses'].keys()[0] + '='
-                    for value in s['addresses'].values():
-                        for v in value:
-                            networks += v['addr'] + ', '
-                s['networks'] = networks.rstrip(', ')
-                flavor = self.flavors_dict[s['flavor']['id']].to_dict()
-                s['flavor details'] = format_flavor_details(flavor)
+        def get_lbaas_v2(resource, list_resources, key, record_class):
+            def fetch():
+                if not self.has_network_extension('lbaasv2'):
+                    return
                 try:
-                    s['image name'] = self.images_dict[s['image']['id']].to_dict().get('name', '-')
+                    setattr(self, resource, [row for page in self.cached(resource, neutron_pages(
+                        getattr(self.neutron_client, list_resources), key, page_sizes['network'],
+                        **self.projected(record_class)))
+                        for row in page])
                 except Exception as e:
-                    s['image name'] = '-'
+                    setattr(self, resource, [])
+                    logging.error("Could not retrieve list of %s" % resource)
+                    self.fetch_incomplete[resource] = 'failed'
+            return fetch
+
+        for resource, list_resources, key, record_class in (
+                ('loadbalancers', 'list_loadbalancers', 'loadbalancers', LoadBalancer),
+                ('listeners', 'list_listeners', 'listeners', Listener),
+                ('lbaas_v2_pools', 'list_lbaas_pools', 'pools', LbaasPool),
+                ('healthmonitors', 'list_lbaas_healthmonitors', 'healthmonitors', HealthMonitor)):
+            self.scheduler.add(resource, get_lbaas_v2(resource, list_resources, key, record_class),
+                               depends=('network_extensions',))
+
+        def get_lbaas_v2_members():
+            if not self.has_network_extension('lbaasv2'):
+                return
+            try:
+                # Members are listed by pool, for the pools which have some
+                pool_ids = [pool['id'] for pool in self.lbaas_v2_pools if pool.get('members')]
 
-                servers_table.add_row([s['id'], s.get('name', '-'), s['status'], s.get('image name', '-'),
-                                       s['flavor details'], s['key_name'], s['networks']])
-        except Exception as e:
-            pass
+                def list_members(pool_id):
+                    fetch_context.name = 'lbaas_v2_members'
+                    return [dict(member, pool_id=pool_id) for member in self.neutron_client.list_lbaas_members(
+                        pool_id, **self.projected(LbaasMember))['members']]
 
-        # Print List of IPs
-        try:
-            columns = ['ID', 'Fixed IP', 'IP', 'Server ID']
-            ips_table = prettytable.PrettyTable(columns)
-            for ip in self.ips:
-                self.print_ips = True
-                ip_dict = ip.to_dict()
-                if not ip.instance_id:
-                    ip.instance_id = '***Not Used***'
-                if not ip.fixed_ip:
-                    ip.instance_id = '-'
-                ips_table.add_row([ip.id, ip.fixed_ip, ip.ip,
-                                   ip.instance_id])
+                def pages():
+                    executor = futures.ThreadPoolExecutor(max_workers=max(1, min(10, len(pool_ids))))
+                    try:
+                        for members in executor.map(list_members, pool_ids):
+                            yield members
+                    finally:
+                        executor.shutdown()
 
-        except Exception as e:
-            pass
+                self.lbaas_v2_members = [row for page in self.cached('lbaas_v2_members', pages())
+                                         for row in page]
+            except Exception as e:
+                self.lbaas_v2_members = []
+                logging.error("Could not retrieve list of lbaas_v2_members")
+                self.fetch_incomplete['lbaas_v2_members'] = 'failed'
 
-        # Print List of Keys
-        try:
-            columns = ['Name', 'Fingerprint']
-            keys_table = prettytable.PrettyTable(columns)
-            for k in self.keys:
-                self.print_keys = True
-                keys_table.add_row([k.name, k.fingerprint])
-        except Exception as e:
-            pass
+        self.scheduler.add('lbaas_v2_members', get_lbaas_v2_members, depends=('lbaas_v2_pools',))
 
-        # Print List of Secgps
-        try:
-            columns = ['Name', 'Description', 'Protocol', 'From Port', 'To Port', 'IP Range']
-            secgps_table = prettytable.PrettyTable(columns)
-            for secgp in self.securitygps:
-                self.print_scgps = True
-                secgps_table.add_row([secgp.get('name', '-'), secgp['description'], '', '', '', ''])
-                for sec in filter(None, secgp['rules']):
-                    secgps_table.add_row(['', '', sec['ip_protocol'], sec['from_port'],
-                                          sec['to_port'], sec['ip_range']])
-        except Exception as e:
-            pass
+        def get_stacks():
+            try:
+                self.stacks = self.collection('stacks',
+                                              self.cached('stacks',
+                                                          marker_pages(self.heat_client.stacks.list,
+                                                                       page_sizes['orchestration'])),
+                                              "Could not retrieve list of stacks")
+            except Exception as e:
+                self.stacks = []
+                logging.error("Could not retrieve list of stacks")
+                self.fetch_incomplete['stacks'] = 'failed'
 
-        # Print List of Images
-        try:
-            images = []
-            cloudwatt_images = False
-            shared_images = False
-            snapshots = False
-            all_images = False
-            owned_images = False
-
-            columns = ['ID', 'Name', 'Status', 'Size', 'Disk format', 'Created_at']
-            owned_table = prettytable.PrettyTable(columns)
-            shared_table = prettytable.PrettyTable(columns)
-            cloudwatt_table = prettytable.PrettyTable(columns)
-            snapshots_table = prettytable.PrettyTable(columns)
-            all_table = prettytable.PrettyTable(columns)
-
-            for img in self.images:
-                self.print_images = True
-                category = get_image_category(img, config['project'])
-                if category == 'project':
-                    self.print_owned_images = True
-                    owned_table.add_row([img.id, img.to_dict().get('name', '-'), img.status, img.size,
-                                         img.disk_format, img.created_at])
-                if category == 'shared':
-                    self.print_shared_imges = True
-                    shared_table.add_row([img.id, img.to_dict().get('name', '-'), img.status, img.size,
-                                          img.disk_format, img.created_at])
-                elif category == 'cloudwatt':
-                    self.print_cloudwatt_images = True
-                    cloudwatt_table.add_row([img.id, img.to_dict().get('name', '-'), img.status, img.size,
-                                             img.disk_format, img.created_at])
-
-                if 'image_type' in img.properties:
-                    if img.properties['image_type'] == "snapshot":
-                        self.print_snapshots_images = True
-                        snapshots_table.add_row([img.id, img.to_dict().get('name', '-'), img.status, img.size,
-                                                 img.disk_format, img.created_at])
-                all_table.add_row([img.id, img.to_dict().get('name', '-'), img.status, img.size,
-                                   img.disk_format, img.created_at])
-        except Exception as e:
-            pass
+        self.scheduler.add('stacks', get_stacks)
 
-        # Print List of Volumes
-        try:
-            columns = ['ID', 'Status', 'Name',
-                       'Size', 'Volume Type', 'Bootable',
-                       'Attached_to', 'Snapshot ID', 'Created at']
-            volumes_table = prettytable.PrettyTable(columns)
-            for volume in self.volumes:
-                self.print_volumes = True
-                if volume.snapshot_id is None:
-                    volume.snapshot_id = '***-***'
-                volume.Attached_to = '***Not Attached***'
-                for attch in volume.attachments:
+        def get_stack_resources():
+            try:
+                # The stacks listed are read again for their outputs, by the walk
+                self.stacks = list(self.stacks)
+                stack_ids = [as_dict(stack)['id'] for stack in self.stacks]
+                failed = []
+
+                def visit(stack_id):
+                    # A stack which cannot be read is skipped, the walk goes on
+                    fetch_context.name = 'stack_resources'
                     try:
-                        volume.Attached_to = self.nova_client.servers.get(attch['server_id']).to_dict()['name']
+                        stack = as_dict(self.heat_client.stacks.get(stack_id))
+                        resources = [dict(as_dict(resource), stack_id=stack_id)
+                                     for resource in self.heat_client.resources.list(stack_id)]
                     except Exception as e:
-                        pass
-                volumes_table.add_row([volume.id, volume.status, volume.to_dict().get('name', '-'), volume.size,
-                                       volume.volume_type, volume.bootable,
-                                       volume.Attached_to, volume.snapshot_id,
-                                       volume.created_at])
-        except Exception as e:
-            pass
-
-        # print Volumes Snapshots
+                        if is_not_found(e):
+                            logging.warning("Stack %s was deleted while its resources were retrieved" % stack_id)
+                        else:
+                            logging.error("Could not retrieve resources of stack %s" % stack_id)
+                            failed.append(stack_id)
+                        return None, []
+                    return {'stack': stack, 'resources': resources}, filter(None, map(nested_stack_id, resources))
+
+                def pages():
+                    # In the order of the stacks, each followed by its nested stacks
+                    visited = dict((row['stack']['id'], row) for row in walk(
+                        stack_ids, visit, max(1, min(STACK_WORKERS, len(stack_ids)))) if row is not None)
+                    ordered = []
+                    stack_ids_left = list(reversed(stack_ids))
+                    while stack_ids_left:
+                        row = visited.pop(stack_ids_left.pop(), None)
+                        if row is not None:
+                            ordered.append(row)
+                            stack_ids_left.extend(reversed(filter(None, map(nested_stack_id, row['resources']))))
+                    yield ordered
+
+                rows = [row for page in self.cached('stack_resources', pages()) for row in page]
+                self.nested_stacks = [row['stack'] for row in rows if row['stack']['id'] not in stack_ids]
+                self.stack_resources = [resource for row in rows for resource in row['resources']]
+                self.stack_outputs = [dict(output, stack_id=row['stack']['id'])
+                                      for row in rows for output in row['stack'].get('outputs') or []]
+                if failed:
+                    self.fetch_incomplete['stack_resources'] = 'failed'
+                    if self.cache is not None:
+                        # The stacks missing are listed again by the next run
+                        self.cache.expire('stack_resources')
+            except Exception as e:
+                self.nested_stacks = self.stack_resources = self.stack_outputs = []
+                logging.error("Could not retrieve resources of stacks")
+                self.fetch_incomplete['stack_resources'] = 'failed'
+
+        self.scheduler.add('stack_resources', get_stack_resources, depends=('stacks',))
+
+        self.inventory = None
+        # With the fetches they depend on
+        self.fetches = self.refresh(fetches)
+
+    def client(self, service):
+        """Return the client of a service, created and its library imported on first use"""
+        with self.clients_lock:
+            if service not in self.clients and self.config.get('engine') == 'rest':
+                self.clients[service] = REST_CLIENTS[service](
+                    rest_engine(self.config.get('engine_concurrency', ENGINE_CONCURRENCY)),
+                    self.session, self.config['region_name'])
+            elif service not in self.clients:
+                self.clients[service] = CLIENTS[service](importlib.import_module(CLIENT_MODULES[service]),
+                                                         self.session, self.config['region_name'])
+            return self.clients[service]
+
+    @property
+    def nova_client(self):
+        return self.client('nova')
+
+    @property
+    def cinder_client(self):
+        return self.client('cinder')
+
+    @property
+    def glance_client(self):
+        return self.client('glance')
+
+    @property
+    def neutron_client(self):
+        return self.client('neutron')
+
+    @property
+    def heat_client(self):
+        return self.client('heat')
+
+    def projected(self, record_class):
+        """Return the parameters of a neutron listing asking for the fields of record_class only"""
+        if not self.projection or record_class.api_fields is None:
+            return {}
+        return {'fields': list(record_class.api_fields)}
+
+    def shows(self, section):
+        """Whether a section is selected, lbaas being the LBaaS v1 sections"""
+        if section == 'lbaas':
+            return 'lbaas_pools' in self.shown or 'lbaas_members' in self.shown
+        return section in self.shown
+
+    def refresh(self, names=None, load=False):
+        """Run the fetches, or those named, and rebuild the sections they fill
+
+        The fetches the named ones depend on are run too. The sections are
+        built when first read, unless load is set, for the inventory to be
+        read by other threads. Return the names of the fetches run.
+        """
+        if names is not None:
+            names = set(names)
+            depends = names
+            while depends:
+                depends = set(d for name in depends for d in self.scheduler.fetchers[name][1]) - names
+                names |= depends
+        # A new dict, the published one may be read by other threads meanwhile
+        incomplete = dict(self.incomplete)
+        for name in names or self.scheduler.fetchers:
+            for section in (name,) + FETCH_RESOURCES[name]:
+                incomplete.pop(section, None)
+        self.fetch_incomplete = incomplete
         try:
-            columns = ['ID', 'Status', 'Name', 'Description', 'Size', 'Created_at']
-            v_snapshots_table = prettytable.PrettyTable(columns)
-
-            for s in self.snapshots:
-                self.print_snapshots = True
-                v_snapshots_table.add_row([s.id, s.status, s.to_dict().get('name', '-'), s.description,
-                                           s.size, s.created_at])
-        except Exception as e:
-            pass
+            for name, reason in self.scheduler.run(names).items():
+                incomplete.setdefault(name, reason)
+        except KeyboardInterrupt:
+            self.scheduler.cancel()
+            raise
+        inventory = self.build_inventory(names)
+        if load:
+            inventory.load()
+        with self.inventory_lock:
+            self.inventory = inventory
+            self.incomplete = incomplete
+            self.refreshed = time.time()
+        return names or set(self.scheduler.fetchers)
+
+    def has_network_extension(self, alias):
+        """Whether neutron has an extension, assumed when the extensions are unknown"""
+        return self.network_extensions is None or alias in self.network_extensions
+
+    def collection(self, name, pages, error_message):
+        """Return a PagedCollection of pages bound to the timeout of the scheduler
+
+        The fetch creating it is done when its last page is retrieved.
+        """
+        fetch = getattr(fetch_context, 'name', None)
+        started = self.scheduler.started.get(fetch)
+        on_end = (lambda: self.scheduler.end_fetch(fetch, started)) if started else None
+        return PagedCollection(pages, error_message, name=name, timeout=self.scheduler.timeout,
+                               cancelled=self.scheduler.cancelled, incomplete=self.fetch_incomplete,
+                               profiler=self.profiler, on_end=on_end)
+
+    def cached(self, resource, pages):
+        """Return the pages of resource, from the cache when it is fresh"""
+        if self.cache is None:
+            return pages
+        return self.cache.pages(resource, pages)
+
+    def synced(self, resource, pages, list_changes, is_deleted):
+        """Return the pages of resource, in delta mode from the changes since the cache
+
+        See InventoryCache.merge for the arguments.
+        """
+        if (self.cache is None or not self.delta or
+                self.cache.fresh(resource) or not self.cache.exists(resource)):
+            return self.cached(resource, pages)
+        return self.cache.merge(resource, list_changes, is_deleted)
+
+    def filtered(self, resource, pages):
+        """Return the pages of resource listed with its filters, without the rows not matching them
+
+        Filtered listings are neither cached nor synced.
+        """
+        return filtered_pages(pages, row_matcher(resource, self.filters[resource], self.config['project']))
+
+    @property
+    def deltas(self):
+        if self.cache is None:
+            return {}
+        return self.cache.deltas
+
+    def connection_stats(self):
+        return self.session.session.get_adapter('https://').connection_stats()
+
+    def retries(self):
+        return self.session.session.get_adapter('https://').retried
+
+    def title(self, title, *names):
+        """Return the title of a section, marked when its data is incomplete"""
+        if any(name in self.incomplete for name in names):
+            title += ' (INCOMPLETE)'
+        return '\n%s\n' % title
+
+    def endpoints(self):
+        """Return the service type of each endpoint URL of the catalog"""
+        endpoints = {self.config['auth_url'].rstrip('/'): 'identity'}
+        auth_ref = getattr(self.session.auth, 'auth_ref', None)
+        if auth_ref is None:
+            return endpoints
+        for service_type, service_endpoints in auth_ref.service_catalog.get_endpoints().items():
+            for endpoint in service_endpoints:
+                for key, url in endpoint.items():
+                    if key.lower().endswith('url') and url:
+                        endpoints[url.rstrip('/')] = service_type
+        return endpoints
+
+    def print_profile(self, out=sys.stdout):
+        if self.profiler is None:
+            return
+        endpoints = self.endpoints()
+        if self.config.get('profile'):
+            self.profiler.report(out, endpoints)
+        if self.config.get('profile_jsonl'):
+            self.profiler.write_jsonl(self.config['profile_jsonl'], endpoints,
+                                      project=self.config['project'],
+                                      region=self.config['region_name'])
+
+    def save_token(self):
+        """Store the token of the session in the token cache file, if any"""
+        if self.config.get('token_cache'):
+            try:
+                save_auth_state(self.session.auth, self.config)
+            except Exception as e:
+                logging.error("Could not save token in %s" % self.config['token_cache'])
+
+    def print_deltas(self, out=sys.stdout):
+        if not self.deltas:
+            return
+        delta_table = prettytable.PrettyTable(['Resource', 'Change', 'ID'])
+        for resource, delta in sorted(self.deltas.items()):
+            for change in ('added', 'removed', 'modified'):
+                for row_id in delta[change]:
+                    delta_table.add_row([resource, change, row_id])
+        print >>out, '\nChanges since the previous inventory\n'
+        print >>out, delta_table
+
+    def cached_rows(self, resource, list_all):
+        return [row for page in self.cached(resource, single_page(list_all)) for row in page]
+
+    def resolve_servers(self, server_ids, max_workers=10):
+        """Add to servers_dict the servers not returned by get_servers
+
+        Servers attached from another project are not in the servers list,
+        they are fetched concurrently, once each.
+        """
+        missing = set(server_ids) - set(self.servers_dict)
+        if not missing:
+            return
+
+        def get_server(server_id):
+            fetch_context.name = 'server_lookups'
+            try:
+                return self.nova_client.servers.get(server_id).to_dict()
+            except Exception as e:
+                return None
 
-        # print Volumes Backups
+        if self.profiler:
+            self.profiler.start_fetch('server_lookups')
+        executor = futures.ThreadPoolExecutor(max_workers=min(max_workers, len(missing)))
         try:
-            backups_table = prettytable.PrettyTable(columns)
-
-            for b in self.backups:
-                self.print_backups = True
-                backups_table.add_row([s.id, s.status, s.to_dict().get('name', '-'), s.description,
-                                       s.size, s.created_at])
-
-            routers_table = prettytable.PrettyTable(['ID', 'Name', 'Status', 'Network ID'])
-            networks_table = prettytable.PrettyTable(['Name', 'Status', 'Subnet', 'Subnet ID',
-                                                      'Subnet Allocation Pool', 'Gateway IP',
-                                                      'CIDR'])
-
-            networks = {}
-            subnets = {}
-            routers = {}
-            routers_details = []
-            for subnet in self.subnets:
-                subnets[subnet['id']] = subnet
-
-            routers = self.routers
-
-            for network in self.networks:
-                network['subnet_details'] = []
-                network['router_details'] = []
-                for subnet in network['subnets']:
-                    try:
-                        network['subnet_details'].append(subnets[subnet])
-                        networks[network['id']] = network
-                    except Exception as e:
-                        networks[network['id']] = network
-
-            for router in routers:
-                self.print_routers = True
-                try:
-                    router_table.add_row([router['id'], router['name'], router['status'],
-                                          router['external_gateway_info']['network_id']])
-
-                    networks[router['external_gateway_info']['network_id']] \
-                        ['router_details'].append(router)
-                except Exception as e:
-                    routers_table.add_row([router['id'], router['name'], router['status'], '---'])
-
-            for network in networks.values():
-                self.print_netowrks = True
-                networks_table.add_row([network.get('name', '-'), network['status'], '', '', '', '', ''])
-                for subnet in network['subnet_details']:
-                    if not subnet['name']:
-                        subnet['name'] = '---'
-                    networks_table.add_row(['', '', subnet.get('name', '-'), subnet['id'], subnet['allocation_pools'],
-                                            subnet['gateway_ip'], subnet['cidr']])
-        except Exception as e:
-            pass
-
-        # Print List Of LBAAS
+            for server_id, server in zip(missing, executor.map(get_server, missing)):
+                if server:
+                    self.servers_dict[server_id] = Server.from_row(server)
+        finally:
+            executor.shutdown()
+            if self.profiler:
+                self.profiler.end_fetch('server_lookups')
+        self.server_lookups += len(missing)
+
+    def matching_records(self, resource, from_row, rows, filtered):
+        """Return the records of the rows matching the filters of resource, adding the others to filtered"""
+        matches = row_matcher(resource, self.filters[resource], self.config['project']) \
+            if self.filters.get(resource) else None
+        records = []
+        for row in rows:
+            record = from_row(row)
+            if matches is None or matches(row):
+                records.append(record)
+            else:
+                filtered.append(record)
+        return records
+
+    def build_inventory(self, fetched=None):
+        """Build the inventory records from the rows of the fetches
+
+        Only the sections of the fetches run, by default all of them, are
+        built, the others are those of the current inventory. The records
+        are built when first read, from paged listings which may still be
+        running, and their rows are released then.
+        """
+        resources = set(resource for name in fetched or FETCH_RESOURCES for resource in FETCH_RESOURCES[name])
+        # Rebuilt for the servers deleted since not to stay: only those of
+        # the sections kept are kept, the others are added as built
+        servers_dict = {}
+        if self.inventory is not None:
+            if 'servers' not in resources:
+                servers_dict.update((server.id, server) for server in
+                                    self.inventory.servers + self.inventory.filtered_servers)
+            if 'volumes' not in resources:
+                attached = set(server_id for volume in self.inventory.volumes for server_id in volume.server_ids)
+                servers_dict.update((server_id, server) for server_id, server in self.servers_dict.items()
+                                    if server_id in attached)
+        self.servers_dict = servers_dict
+        inventory = Inventory(servers_dict)
+        if self.inventory is not None:
+            for resource in Inventory.RESOURCES:
+                if resource not in resources:
+                    setattr(inventory, resource, getattr(self.inventory, resource))
+            if 'images' not in resources:
+                inventory.filtered_images = self.inventory.filtered_images
+            if 'servers' not in resources:
+                inventory.filtered_servers = self.inventory.filtered_servers
+
+        if 'limits' in resources:
+            limits = {'nova': self.nova_limits, 'cinder': self.cinder_limits}
+            if self.nova_limits and self.cinder_limits:
+                inventory.limits = [Limit(name, limits[service].get(max_key), limits[service].get(used_key))
+                                    for name, service, max_key, used_key in LIMITS]
+            self.nova_limits = self.cinder_limits = []
+        for resource, record_class, rows in (('flavors', Flavor, 'flavors'),
+                                             ('floating_ips', FloatingIP, 'ips'),
+                                             ('keypairs', KeyPair, 'keys'),
+                                             ('security_groups', SecurityGroup, 'securitygps'),
+                                             ('volume_snapshots', VolumeSnapshot, 'snapshots'),
+                                             ('volume_backups', VolumeBackup, 'backups'),
+                                             ('networks', Network, 'networks'),
+                                             ('subnets', Subnet, 'subnets'),
+                                             ('routers', Router, 'routers'),
+                                             ('lbaas_pools', Pool, 'lbaas_pools'),
+                                             ('lbaas_members', Member, 'members'),
+                                             ('loadbalancers', LoadBalancer, 'loadbalancers'),
+                                             ('listeners', Listener, 'listeners'),
+                                             ('lbaas_v2_pools', LbaasPool, 'lbaas_v2_pools'),
+                                             ('lbaas_v2_members', LbaasMember, 'lbaas_v2_members'),
+                                             ('healthmonitors', HealthMonitor, 'healthmonitors'),
+                                             ('stacks', Stack, 'stacks'),
+                                             ('nested_stacks', NestedStack, 'nested_stacks'),
+                                             ('stack_resources', StackResource, 'stack_resources'),
+                                             ('stack_outputs', StackOutput, 'stack_outputs')):
+            if resource in resources:
+                inventory.defer(resource, functools.partial(build_records, record_class, getattr(self, rows)))
+                setattr(self, rows, [])
+        if 'images' in resources:
+            images = self.images
+
+            def build_images():
+                project = self.config['project']
+                return self.matching_records('images', lambda row: Image.from_row(row, project), images,
+                                             inventory.filtered_images)
+            inventory.defer('images', build_images)
+            self.images = []
+        if 'servers' in resources:
+            servers = self.servers
+
+            def build_servers():
+                records = self.matching_records('servers', Server.from_row, servers, inventory.filtered_servers)
+                self.servers_dict.update((server.id, server) for server in records + inventory.filtered_servers)
+                return records
+            inventory.defer('servers', build_servers)
+            self.servers = []
+        if 'volumes' in resources:
+            volume_rows = self.volumes
+
+            def build_volumes():
+                # The servers of the project first, the servers of other
+                # projects attached to the volumes are fetched page by page
+                inventory.servers
+                records = []
+                pages = volume_rows.pages() if isinstance(volume_rows, PagedCollection) else [volume_rows]
+                for page in pages:
+                    volumes = [Volume.from_row(row) for row in page]
+                    self.resolve_servers([server_id for volume in volumes for server_id in volume.server_ids])
+                    records.extend(volumes)
+                return records
+            inventory.defer('volumes', build_volumes)
+            self.volumes = []
+        return inventory
+
+    def records(self):
+        """Yield the records of the selected resources, the changes and the incomplete sections"""
+        for record in self.inventory_records():
+            if record['resource'] in ('changes', 'incomplete') or self.shows(record['resource']):
+                yield record
+
+    def inventory_records(self):
+        """Yield the inventory as records, one dict per resource"""
+        inventory = self.inventory
+        for limit in inventory.limits:
+            yield limit.to_dict()
+
+        for server in inventory.servers:
+            flavor = inventory.flavor(server)
+            image = inventory.image(server)
+            record = server.to_dict()
+            record['image_name'] = image.name if image else None
+            record['flavor'] = flavor.details if flavor else None
+            yield record
+
+        for resource in ('floating_ips', 'keypairs', 'security_groups', 'images'):
+            for row in getattr(inventory, resource):
+                yield row.to_dict()
+
+        for volume in inventory.volumes:
+            record = volume.to_dict()
+            record['attached_to'] = [server.name for server in inventory.attached_servers(volume)]
+            yield record
+
+        for resource in ('volume_snapshots', 'volume_backups', 'routers'):
+            for row in getattr(inventory, resource):
+                yield row.to_dict()
+
+        for network in inventory.networks:
+            record = network.to_dict()
+            record['router_ids'] = [router.id for router in inventory.gateways_of(network)]
+            record['subnets'] = [subnet.to_dict() for subnet in inventory.subnets_of(network)]
+            for subnet in record['subnets']:
+                del subnet['resource']
+            yield record
+
+        for resource in ('lbaas_pools', 'lbaas_members', 'loadbalancers', 'listeners', 'lbaas_v2_pools',
+                         'lbaas_v2_members', 'healthmonitors', 'stacks', 'nested_stacks'):
+            for row in getattr(inventory, resource):
+                yield row.to_dict()
+
+        for stack_resource in inventory.stack_resources:
+            record = stack_resource.to_dict()
+            target = inventory.stack_target(stack_resource)
+            record['inventoried_as'] = '%s %s' % (target[0], target[1].name) if target else None
+            yield record
+
+        for output in inventory.stack_outputs:
+            yield output.to_dict()
+
+        for resource, delta in sorted(self.deltas.items()):
+            for change in ('added', 'removed', 'modified'):
+                for row_id in delta[change]:
+                    yield {'resource': 'changes', 'id': row_id, 'changed': resource, 'change': change}
+
+        for name, reason in sorted(self.incomplete.items()):
+            yield {'resource': 'incomplete', 'name': name, 'status': reason}
+
+    def target_records(self):
+        """Yield the records of the inventory with the project and region they belong to"""
+        for record in self.records():
+            record['project'] = self.config['project']
+            record['region'] = self.config['region_name']
+            yield record
+
+    def write_records(self, writer):
+        for record in self.target_records():
+            writer.write(record)
+
+    def store_inventory(self, store):
+        """Save the resources fetched to the store, but the incomplete and filtered ones"""
+        # Which listings are incomplete is known once they are all read
+        self.inventory.load()
+        resources = [resource for resource in STORE_RECORDS
+                     if RESOURCE_FETCHES[resource] in self.fetches and resource not in self.filters
+                     and resource not in self.incomplete and RESOURCE_FETCHES[resource] not in self.incomplete]
+        store.save(self.config['project'], self.config['region_name'], self.inventory, resources)
+
+    def section(self, title, columns, rows, names, always=False):
+        """Return the title and table of a section, None when it has no rows
+
+        An incomplete section is shown even without rows. The first name is
+        the section, shown when it is selected. Sections of more than
+        stream_rows rows get a StreamingTable.
+        """
+        if not self.shows(names[0]):
+            return None
+        if not (rows or always or any(name in self.incomplete for name in names)):
+            return None
+        if len(rows) > self.config.get('stream_rows', STREAM_ROWS):
+            return self.title(title, *names), StreamingTable(columns, rows)
+        table = prettytable.PrettyTable(columns)
+        for row in rows:
+            table.add_row(row)
+        return self.title(title, *names), table
+
+    def tables(self):
+        """Yield the title and table of each section of the report, as they are built"""
+        return itertools.ifilter(None, self.sections())
+
+    def sections(self):
+        """Yield the title and table of each section of the report, None for those not shown"""
+        inventory = self.inventory
+        yield self.section('Quotas and Usage Limits', ['Resource', 'Max', 'Used'],
+                           [[limit.name, limit.max, limit.used] for limit in inventory.limits],
+                           ['limits'], always=True)
+
+        rows = []
+        for server in inventory.servers:
+            flavor = inventory.flavor(server)
+            image = inventory.image(server)
+            networks = ''
+            if server.addresses:
+                networks = server.addresses[0][0] + '=' + ', '.join(address for _, addresses in server.addresses
+                                                                    for address in addresses)
+            rows.append([server.id, or_dash(server.name), server.status, or_dash(image and image.name),
+                         flavor.details if flavor else '-', server.key_name, networks])
+        yield self.section('List of Servers', ['ID', 'Name', 'Status', 'Image Name', 'Flavor Details',
+                                               'Key Name', 'Networks'],
+                           rows, ['servers', 'flavors', 'images'])
+
+        rows = []
+        for ip in inventory.floating_ips:
+            if not ip.fixed_ip:
+                instance_id = '-'
+            else:
+                instance_id = ip.instance_id or '***Not Used***'
+            rows.append([ip.id, ip.fixed_ip, ip.ip, instance_id])
+        yield self.section('List of Floating IPs', ['ID', 'Fixed IP', 'IP', 'Server ID'],
+                           rows, ['floating_ips'])
+
+        yield self.section('List of Keys', ['Name', 'Fingerprint'],
+                           [[key.name, key.fingerprint] for key in inventory.keypairs],
+                           ['keypairs'])
+
+        rows = []
+        for secgp in inventory.security_groups:
+            rows.append([or_dash(secgp.name), secgp.description, '', '', '', ''])
+            for rule in secgp.rules:
+                rows.append(['', '', rule.protocol, rule.from_port, rule.to_port, rule.ip_range])
+        yield self.section('List of Security groups', ['Name', 'Description', 'Protocol', 'From Port',
+                                                       'To Port', 'IP Range'],
+                           rows, ['security_groups'])
+
+        columns = ['ID', 'Name', 'Status', 'Size', 'Disk format', 'Created_at']
+        rows = [[img.id, or_dash(img.name), img.status, img.size, img.disk_format, img.created_at]
+                for img in inventory.images]
+        for title, category in (('List of Owned Images', 'project'), ('List of Shared Images', 'shared'),
+                                ('List of Cloudwatt Images', 'cloudwatt'), ('List of Snapshots', 'snapshot')):
+            view = inventory.image_view(rows, category)
+            if view:
+                yield self.section(title, columns, view, ['images'])
+        yield self.section('ALL Available Images', columns, rows, ['images'])
+
+        rows = []
+        for volume in inventory.volumes:
+            attached_to = inventory.attached_servers(volume)
+            rows.append([volume.id, volume.status, or_dash(volume.name), volume.size, volume.volume_type,
+                         volume.bootable, attached_to[-1].name if attached_to else '***Not Attached***',
+                         volume.snapshot_id or '***-***', volume.created_at])
+        yield self.section('List of Volumes', ['ID', 'Status', 'Name', 'Size', 'Volume Type', 'Bootable',
+                                               'Attached_to', 'Snapshot ID', 'Created at'],
+                           rows, ['volumes', 'servers'])
+
+        columns = ['ID', 'Status', 'Name', 'Description', 'Size', 'Created_at']
+        for title, resource in (('List of Volumes Snapshots', 'volume_snapshots'),
+                                ('List of Volumes Backups', 'volume_backups')):
+            yield self.section(title, columns,
+                               [[row.id, row.status, or_dash(row.name), row.description, row.size,
+                                 row.created_at] for row in getattr(inventory, resource)],
+                               [resource])
+
+        rows = []
+        for network in inventory.networks:
+            rows.append([or_dash(network.name), network.status, '', '', '', '', ''])
+            for subnet in inventory.subnets_of(network):
+                rows.append(['', '', subnet.name or '---', subnet.id, subnet.allocation_pools,
+                             subnet.gateway_ip, subnet.cidr])
+        yield self.section('List of Networks', ['Name', 'Status', 'Subnet', 'Subnet ID',
+                                                'Subnet Allocation Pool', 'Gateway IP', 'CIDR'],
+                           rows, ['networks', 'subnets'])
+        yield self.section('List of Routers', ['ID', 'Name', 'Status', 'Network ID'],
+                           [[router.id, router.name, router.status, router.network_id or '---']
+                            for router in inventory.routers],
+                           ['routers'])
+
+        yield self.section('List of LBAAS pools', ['ID', 'Name', 'Status', 'Provider', 'lb_method',
+                                                   'admin_state_up', 'Protocol'],
+                           [[pool.id, or_dash(pool.name), pool.status, pool.provider, pool.lb_method,
+                             pool.admin_state_up, pool.protocol] for pool in inventory.lbaas_pools],
+                           ['lbaas'])
+        if inventory.lbaas_members:
+            rows = []
+            for pool in inventory.lbaas_pools:
+                rows.append([or_dash(pool.name), '', '', '', ''])
+                for member in inventory.members_of(pool):
+                    rows.append(['', member.id, member.status, member.address, member.protocol_port])
+            yield self.section('List of LBAAS members', ['Name', 'Member ID', 'Member Status',
+                                                         'Member Address', 'Member Protocol Port'],
+                               rows, ['lbaas'])
+
+        rows = []
+        for loadbalancer in inventory.loadbalancers:
+            listeners = ', '.join('%s:%s' % (listener.protocol, listener.protocol_port)
+                                  for listener in inventory.listeners_of(loadbalancer))
+            rows.append([loadbalancer.id, or_dash(loadbalancer.name), loadbalancer.vip_address,
+                         loadbalancer.provisioning_status, loadbalancer.operating_status, listeners])
+        yield self.section('List of Load Balancers', ['ID', 'Name', 'VIP Address', 'Provisioning Status',
+                                                      'Operating Status', 'Listeners'],
+                           rows, ['loadbalancers', 'listeners'])
+        rows = []
+        for pool in inventory.lbaas_v2_pools:
+            monitor = inventory.healthmonitor(pool)
+            rows.append([pool.id, or_dash(pool.name),
+                         ', '.join(or_dash(lb.name) for lb in inventory.loadbalancers_of(pool)),
+                         pool.protocol, pool.lb_algorithm, pool.admin_state_up,
+                         monitor.details if monitor else '-', '', '', ''])
+            for member in inventory.members_of(pool):
+                rows.append(['', '', '', '', '', member.admin_state_up, '', member.address, member.protocol_port,
+                             member.operating_status])
+        yield self.section('List of LBAAS v2 pools and members', ['ID', 'Name', 'Load Balancers',
+                                                                 'Protocol', 'lb_algorithm',
+                                                                 'admin_state_up', 'Health Monitor',
+                                                                 'Member Address', 'Member Port',
+                                                                 'Member Status'],
+                           rows, ['lbaas_v2_pools', 'lbaas_v2_members', 'healthmonitors'])
+
+        yield self.section('List of Stacks', ['Stack_Name', 'Creation Time', 'Stack Status',
+                                              'Stack Status Reason'],
+                           [[or_dash(stack.name), stack.creation_time, stack.status, stack.status_reason]
+                            for stack in inventory.stacks],
+                           ['stacks'])
+        yield self.section('List of Nested Stacks', ['ID', 'Stack_Name', 'Parent Stack', 'Creation Time',
+                                                     'Stack Status'],
+                           [[stack.id, or_dash(stack.name), inventory.stack_name(stack.parent_id),
+                             stack.creation_time, stack.status] for stack in inventory.nested_stacks],
+                           ['nested_stacks', 'stack_resources'])
+
+        rows = []
+        for stack_resource in inventory.stack_resources:
+            target = inventory.stack_target(stack_resource)
+            rows.append([inventory.stack_name(stack_resource.stack_id), stack_resource.name, stack_resource.type,
+                         stack_resource.status, or_dash(stack_resource.physical_id),
+                         '%s %s' % (target[0], or_dash(target[1].name)) if target else '-'])
+        yield self.section('List of Stack Resources', ['Stack_Name', 'Resource', 'Type', 'Status', 'Physical ID',
+                                                       'Inventoried As'],
+                           rows, ['stack_resources'])
+        yield self.section('List of Stack Outputs', ['Stack_Name', 'Output', 'Value', 'Description'],
+                           [[inventory.stack_name(output.stack_id), output.key, output.value, output.description]
+                            for output in inventory.stack_outputs],
+                           ['stack_outputs', 'stack_resources'])
+
+    def print_ressources(self, out=sys.stdout):
+        streams = [out]
+        if self.config['file']:
+            streams.append(open('list_ressources.txt', 'w'))
         try:
-            lbaas_pools = self.lbaas_pools
-            members = self.members
-            columns = ['ID', 'Name', 'Status', 'Provider',
-                       'lb_method', 'admin_state_up', 'Protocol']
-            lbaas_table = prettytable.PrettyTable(columns)
-            members_table = prettytable.PrettyTable(['Name', 'Member ID', 'Member Status',
-                                                     'Member Address', 'Member Protocol Port'])
-            for lbaas_pool in lbaas_pools:
-                self.print_lbaas_pools = True
-                lbaas_pool['members'] = []
-                members_table.add_row([lbaas_pool.get('name', '-'), '', '', '', ''])
-                for m in members:
-                    self.print_members = True
-                    if m['pool_id'] == lbaas_pool['id']:
-                        members_table.add_row(['', m['id'], m['status'], m['address'], m['protocol_port']])
-                lbaas_table.add_row([lbaas_pool['id'], lbaas_pool.get('name', '-'), lbaas_pool['status'],
-                                     lbaas_pool['provider'], lbaas_pool['lb_method'],
-                                     lbaas_pool['admin_state_up'], lbaas_pool['protocol']])
+            for title, table in self.tables():
+                for stream in streams:
+                    print >>stream, title
+                if isinstance(table, StreamingTable):
+                    table.write(streams)
+                    continue
+                for stream in streams:
+                    print >>stream, table
+            # The listings of the sections not shown are read too, which
+            # are incomplete is known then
+            self.inventory.load()
+            if self.incomplete:
+                for stream in streams:
+                    print >>stream, '\nIncomplete: %s\n' % ', '.join('%s (%s)' % item
+                                                                   for item in sorted(self.incomplete.items()))
+        finally:
+            for stream in streams[1:]:
+                stream.close()
+
+
+def inventory_all(targets, workers, out=sys.stdout, writer=None, snapshot=None):
+    """Inventory several projects and regions into one report
+
+    Each project is fetched and rendered by a worker of a bounded pool,
+    with its own session. The reports are written in the order of targets
+    and the inventories are returned. With a writer, the records of the
+    projects are written as they come, and the report only has profiles.
+    The records are also written to the snapshot writer, if any.
+    """
+    def inventory(target):
+        rendered = StringIO.StringIO()
+        try:
+            utility = OpenStackUtils(dict(target, file=None))
+            if writer is not None:
+                utility.write_records(writer)
+            else:
+                utility.print_ressources(rendered)
+                utility.print_deltas(rendered)
+            if snapshot is not None:
+                utility.write_records(snapshot)
+            utility.print_profile(rendered)
+            utility.save_token()
         except Exception as e:
-            pass
+            logging.error("Could not retrieve resources of project %s in region %s"
+                          % (target['project'], target['region_name']))
+            return None, ''
+        return utility, rendered.getvalue()
+
+    utilities = []
+    report = open('list_ressources.txt', 'w') if targets[0]['file'] else None
+    executor = futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        for target, (utility, rendered) in zip(targets, executor.map(inventory, targets)):
+            header = '\n===== Project %s - Region %s =====\n' % (target['project'], target['region_name'])
+            for stream in filter(None, [out, report]):
+                stream.write(header)
+                stream.write(rendered)
+            if utility is not None:
+                utilities.append(utility)
+    finally:
+        executor.shutdown()
+        if report is not None:
+            report.close()
+    return utilities
+
+
+def refresh_interval(fetch, ttls):
+    """Return the seconds between two refreshes of a fetch: the shortest TTL of its listings"""
+    listings = {'limits': ('nova_limits', 'cinder_limits'),
+                'network_extensions': ('network_extensions',),
+                'stack_resources': ('stack_resources',)}.get(fetch, FETCH_RESOURCES[fetch])
+    return max(min(ttls[listing] for listing in listings), 1)
+
+
+def prometheus_labels(labels):
+    return ','.join('%s="%s"' % (key, unicode(value).replace('\\', '\\\\').replace('"', '\\"')
+                                 .replace('\n', '\\n'))
+                    for key, value in sorted(labels.items()))
+
+
+def prometheus_metrics(utilities):
+    """Return the metrics of the inventories in the Prometheus text format"""
+    metrics = collections.OrderedDict(
+        (name, (kind, description, [])) for name, kind, description in (
+            ('osinventory_resources', 'gauge', 'Number of inventoried resources'),
+            ('osinventory_quota_max', 'gauge', 'Quota of the project'),
+            ('osinventory_quota_used', 'gauge', 'Usage of the quota of the project'),
+            ('osinventory_fetch_duration_seconds', 'gauge', 'Duration of the last run of a fetch'),
+            ('osinventory_fetch_timestamp_seconds', 'gauge', 'End time of the last run of a fetch'),
+            ('osinventory_incomplete', 'gauge', 'Sections which could not be retrieved completely'),
+            ('osinventory_http_connections_total', 'counter', 'HTTP connections opened or reused'),
+            ('osinventory_api_retries_total', 'counter', 'Throttled API calls retried')))
+
+    def sample(name, labels, value):
+        if value is not None:
+            metrics[name][2].append((labels, value))
+
+    for utility in utilities:
+        target = {'project': utility.config['project'], 'region': utility.config['region_name']}
+        with utility.inventory_lock:
+            inventory, incomplete = utility.inventory, utility.incomplete
+        for resource in sorted(utility.shown):
+            sample('osinventory_resources', dict(target, resource=resource), len(getattr(inventory, resource)))
+        for limit in inventory.limits:
+            sample('osinventory_quota_max', dict(target, quota=limit.name), limit.max)
+            sample('osinventory_quota_used', dict(target, quota=limit.name), limit.used)
+        for name, (duration, finished) in sorted(utility.scheduler.durations.items()):
+            sample('osinventory_fetch_duration_seconds', dict(target, fetch=name), duration)
+            sample('osinventory_fetch_timestamp_seconds', dict(target, fetch=name), finished)
+        for name in sorted(incomplete):
+            sample('osinventory_incomplete', dict(target, section=name), 1)
+        opened, reused = utility.connection_stats()
+        sample('osinventory_http_connections_total', dict(target, state='opened'), opened)
+        sample('osinventory_http_connections_total', dict(target, state='reused'), reused)
+        sample('osinventory_api_retries_total', target, utility.retries())
+
+    lines = []
+    for name, (kind, description, samples) in metrics.items():
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for labels, value in samples:
+            lines.append('%s{%s} %s' % (name, prometheus_labels(labels), value))
+    return '\n'.join(lines) + '\n'
+
+
+class InventoryHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serve the inventories of the server
+
+    GET /inventory returns the records of all the inventories, GET
+    /inventory/RESOURCE the records of a resource type, GET /metrics the
+    Prometheus metrics.
+    """
 
-        # Print List of Stacks
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+    def reply(self, status, body, content_type='application/json'):
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse.urlparse(self.path).path.rstrip('/')
+        utilities = self.server.utilities
+        if path == '/metrics':
+            self.reply(200, prometheus_metrics(utilities), 'text/plain; version=0.0.4')
+        elif path == '/inventory':
+            inventories = []
+            for utility in utilities:
+                with utility.inventory_lock:
+                    inventories.append({'project': utility.config['project'],
+                                        'region': utility.config['region_name'],
+                                        'refreshed': utility.refreshed, 'incomplete': utility.incomplete,
+                                        'records': list(utility.target_records())})
+            self.reply(200, json.dumps({'inventories': inventories}, default=str))
+        elif path.startswith('/inventory/') and path.split('/', 2)[2] in Inventory.RESOURCES + ('incomplete',):
+            resource = path.split('/', 2)[2]
+            records = []
+            for utility in utilities:
+                with utility.inventory_lock:
+                    records.extend(record for record in utility.target_records() if record['resource'] == resource)
+            self.reply(200, json.dumps(records, default=str))
+        else:
+            self.reply(404, json.dumps({'error': 'Not found: %s' % path}))
+
+
+class InventoryServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, utilities):
+        BaseHTTPServer.HTTPServer.__init__(self, address, InventoryHandler)
+        self.utilities = utilities
+
+
+def refresh_forever(utility, stop):
+    """Refresh each fetch of an inventory when the TTL of its listings expires, until stop is set"""
+    ttls = dict(CACHE_TTLS, **utility.config.get('cache_ttls', {}))
+    intervals = dict((name, refresh_interval(name, ttls)) for name in utility.fetches)
+    due = dict((name, utility.refreshed + interval) for name, interval in intervals.items())
+    while not stop.is_set():
+        names = [name for name, when in due.items() if when <= time.time()]
+        if names:
+            try:
+                names = utility.refresh(names, load=True)
+            except Exception as e:
+                logging.error("Could not refresh %s of project %s in region %s"
+                              % (', '.join(sorted(names)), utility.config['project'],
+                                 utility.config['region_name']))
+            for name in names:
+                due[name] = time.time() + intervals[name]
+            utility.save_token()
+        stop.wait(max(min(due.values()) - time.time(), 1))
+
+
+def serve(targets, address, workers):
+    """Keep the inventories of targets in memory, refreshed, and serve them over HTTP"""
+    def inventory(target):
         try:
-            stacks = self.stacks
-            columns = ['Stack_Name', 'Creation Time', 'Stack Status', 'Stack Status Reason']
-            stacks_table = prettytable.PrettyTable(columns)
-            for stack in stacks:
-                self.print_stacks = True
-                stacks_table.add_row([stack.to_dict().get('stack_name', '-'), stack.creation_time, stack.stack_status,
-                                      stack.stack_status_reason])
+            utility = OpenStackUtils(target)
+            utility.inventory.load()
         except Exception as e:
-            pass
-
-        print '\nQuotas and Usage Limits\n'
-        print limits_table
-
-        if self.print_servers:
-            print '\nList of Servers\n'
-            print servers_table
-
-        if self.print_ips:
-            print '\nList of Floating IPs\n'
-            print ips_table
-
-        if self.print_keys:
-            print '\nList of Keys\n'
-            print keys_table
-
-        if self.print_scgps:
-            print '\nList of Security groups\n'
-            print secgps_table
-
-        if self.print_owned_images:
-            print '\nList of Owned Images\n'
-            print owned_table
-        if self.print_shared_imges:
-            print '\nList of Shared Images\n'
-            print shared_table
-        if self.print_cloudwatt_images:
-            print '\nList of Cloudwatt Images\n'
-            print cloudwatt_table
-        if self.print_snapshots_images:
-            print '\nList of Snapshots\n'
-            print snapshots_table
-        if self.print_images:
-            print '\nALL Available Images\n'
-            print all_table
-
-        if self.print_volumes:
-            print '\nList of Volumes\n'
-            print volumes_table
-
-        if self.print_snapshots:
-            print '\nList of Volumes Snapshots\n'
-            print v_snapshots_table
-
-        if self.print_backups:
-            print '\nList of Volumes Backups\n'
-            print backups_table
-
-        if self.print_netowrks:
-            print '\nList of Networks\n'
-            print networks_table
-        if self.print_routers:
-            print '\nList of Routers\n'
-            print routers_table
-
-        if self.print_lbaas_pools:
-            print '\nList of LBAAS pools\n'
-            print lbaas_table
-        if self.print_members:
-            print '\nList of LBAAS members\n'
-            print members_table
-
-        if self.print_stacks:
-            print '\nList of Stacks\n'
-            print stacks_table
-
-        if (config['file']):
-            with open('list_ressources.txt', 'w') as w:
-                w.write('\nQuotas and Usage Limits\n')
-                w.write(str(limits_table))
-
-                if self.print_servers:
-                    w.write('\nList of Servers\n')
-                    w.write(str(servers_table))
-
-                if self.print_ips:
-                    w.write('\nList of Floating IPs\n')
-                    w.write(str(ips_table))
-
-                if self.print_keys:
-                    w.write('\nList of Keys\n')
-                    w.write(str(keys_table))
-
-                if self.print_scgps:
-                    w.write('\nList of Security groups\n')
-                    w.write(str(secgps_table))
-
-                if self.print_owned_images:
-                    w.write('\nList of Owned Images\n')
-                    w.write(str(owned_table))
-                if self.print_shared_imges:
-                    w.write('\nList of Shared Images\n')
-                    w.write(str(shared_table))
-                if self.print_cloudwatt_images:
-                    w.write('\nList of Cloudwatt Images\n')
-                    w.write(str(cloudwatt_table))
-                if self.print_snapshots_images:
-                    w.write('\nList of Snapshots\n')
-                    w.write(str(snapshots_table))
-                if self.print_servers:
-                    w.write('\nALL Available Images\n')
-                    w.write(str(all_table))
-
-                if self.print_volumes:
-                    w.write('\nList of Volumes\n')
-                    w.write(str(volumes_table))
-
-                if self.print_snapshots:
-                    w.write('\nList of Volumes Snapshots\n')
-                    w.write(str(snapshots_table))
-
-                if self.print_backups:
-                    w.write('\nList of Volumes Backups\n')
-                    w.write(str(backups_table))
-
-                if self.print_netowrks:
-                    print '\nList of Networks\n'
-                    print networks_table
-                if self.print_routers:
-                    print '\nList of Routers\n'
-                    print routers_table
-
-                if self.print_lbaas_pools:
-                    w.write('\nList of LBAAS pools\n')
-                    w.write(str(lbaas_table))
-                if self.print_members:
-                    w.write('\nList of LBAAS members\n')
-                    w.write(str(members_table))
-
-                if self.print_stacks:
-                    w.write('\nList of Stacks\n')
-                    w.write(str(stacks_table))
+            logging.error("Could not retrieve resources of project %s in region %s"
+                          % (target['project'], target['region_name']))
+            return None
+        return utility
+
+    executor = futures.ThreadPoolExecutor(max_workers=min(workers, len(targets)))
+    try:
+        utilities = [utility for utility in executor.map(inventory, targets) if utility is not None]
+    finally:
+        executor.shutdown()
+    if not utilities:
+        return
+    for utility in utilities:
+        utility.save_token()
+
+    stop = threading.Event()
+    for utility in utilities:
+        refresher = threading.Thread(target=refresh_forever, args=(utility, stop))
+        refresher.daemon = True
+        refresher.start()
+    server = InventoryServer(address, utilities)
+    print 'Serving %d inventories on http://%s:%d' % (len(utilities), address[0], server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+
+
+def serve_command(argv):
+    parser = inventory_parser(prog='osinventory.py serve',
+                              description='Keep the inventories in memory, refresh each resource '
+                              'type when its cache TTL expires (see --cache-ttl), and serve them over '
+                              'HTTP: /inventory, /inventory/RESOURCE and /metrics for Prometheus')
+    parser.add_argument('--listen', help='address to listen on (default: 127.0.0.1:%d)' % SERVE_PORT,
+                        default=str(SERVE_PORT), metavar='[HOST:]PORT',
+                        required=False)
+    args = parser.parse_args(argv)
+    host, _, port = args.listen.rpartition(':')
+    if not port.isdigit():
+        parser.error('invalid address to listen on: %s' % args.listen)
+    targets = inventory_targets(parser, args, file=None)
+    serve(targets, (host or '127.0.0.1', int(port)), args.workers)
 
 
-def main():
-    parser = argparse.ArgumentParser(description=
-                                     'Print resources from an OpenStack' \
-                                     'project'
-                                     )
+def inventory_parser(**kwargs):
+    """Return a parser of the options selecting and fetching the inventories"""
+    parser = argparse.ArgumentParser(**kwargs)
     parser.add_argument('-u', '--username', help='OpenStack Username',
                         default=os.environ.get('OS_USERNAME', None),
                         required=False)
@@ -644,35 +3611,331 @@ def main():
     parser.add_argument('-r', '--region_name', help='Region Name',
                         default=os.environ.get('OS_REGION_NAME', None),
                         required=False)
-    parser.add_argument('-f', '--file', help='save output to file',
+    parser.add_argument('--page-size', help='rows per API call for a service, '
+                        'e.g. compute=500 (services: %s)' % ', '.join(sorted(PAGE_SIZES)),
+                        action='append', default=[], metavar='SERVICE=SIZE',
+                        required=False)
+    parser.add_argument('--cache-ttl', help='seconds a cached listing stays fresh, for all '
+                        'resources or for one, e.g. servers=30 (resources: %s)' % ', '.join(sorted(CACHE_TTLS)),
+                        action='append', default=[], metavar='[RESOURCE=]SECONDS',
+                        required=False)
+    parser.add_argument('--no-cache', help='do not read nor write the local cache',
+                        action='store_true', default=False,
+                        required=False)
+    parser.add_argument('--projects', help='comma separated OpenStack projects, '
+                        'inventoried together',
                         default=None,
                         required=False)
-    args = parser.parse_args()
+    parser.add_argument('--regions', help='comma separated region names, '
+                        'inventoried together',
+                        default=None,
+                        required=False)
+    parser.add_argument('--clouds-yaml', help='inventory the clouds of a clouds.yaml file '
+                        'instead of the credentials above',
+                        default=None,
+                        required=False)
+    parser.add_argument('--cloud', help='comma separated clouds of --clouds-yaml to '
+                        'inventory (default: all)',
+                        default=None,
+                        required=False)
+    parser.add_argument('--only', help='comma separated resources to inventory, e.g. servers,volumes '
+                        '(resources: %s)' % ', '.join(Inventory.RESOURCES + ('lbaas',)),
+                        default=None,
+                        required=False)
+    parser.add_argument('--exclude', help='comma separated resources not to inventory',
+                        default=None,
+                        required=False)
+    parser.add_argument('--deep-stacks', help='also inventory the resources, outputs and nested stacks '
+                        'of the stacks, linked to the servers, volumes and networks inventoried',
+                        action='store_true', default=False,
+                        required=False)
+    parser.add_argument('--status', help='list only the resources in this status, e.g. servers=ACTIVE '
+                        '(resources: %s)' % ', '.join(sorted(FILTERS)),
+                        action='append', default=[], metavar='RESOURCE=STATUS',
+                        required=False)
+    parser.add_argument('--name', help='list only the resources whose name matches a regular '
+                        'expression, e.g. servers=^web',
+                        action='append', default=[], metavar='RESOURCE=REGEX',
+                        required=False)
+    parser.add_argument('--created-after', help='list only the resources created since a date, '
+                        'e.g. volumes=2016-06-01',
+                        action='append', default=[], metavar='RESOURCE=DATE',
+                        required=False)
+    parser.add_argument('--tag', help='list only the resources with a tag, or a metadata key, '
+                        'e.g. servers=production',
+                        action='append', default=[], metavar='RESOURCE=TAG',
+                        required=False)
+    parser.add_argument('--image-category', help='list only the images of a category',
+                        choices=PUBLIC_CATEGORIES + ('project', 'shared'), default=None,
+                        required=False)
+    parser.add_argument('--workers', help='number of projects inventoried concurrently',
+                        type=int, default=8,
+                        required=False)
+    parser.add_argument('--auth-concurrency', help='concurrent authentications against '
+                        'one Keystone endpoint',
+                        type=int, default=AUTH_CONCURRENCY,
+                        required=False)
+    parser.add_argument('--token-cache', help='reuse the token stored in this file while it '
+                        'is valid (default file: %s)' % TOKEN_CACHE,
+                        nargs='?', const=TOKEN_CACHE, default=None,
+                        required=False)
+    parser.add_argument('--pool-size', help='HTTP connections kept open per endpoint',
+                        type=int, default=POOL_SIZE,
+                        required=False)
+    parser.add_argument('--no-gzip', help='do not ask for compressed responses',
+                        action='store_true', default=False,
+                        required=False)
+    parser.add_argument('--fetch-workers', help='number of fetches run concurrently for a project',
+                        type=int, default=FETCH_WORKERS,
+                        required=False)
+    parser.add_argument('--fetch-timeout', help='seconds after which a fetch, or a page of a listing, '
+                        'is abandoned and its section reported as incomplete',
+                        type=int, default=FETCH_TIMEOUT,
+                        required=False)
+    parser.add_argument('--no-projection', help='download the whole rows, instead of the fields '
+                        'shown only where the APIs allow it',
+                        action='store_true', default=False,
+                        required=False)
+    parser.add_argument('--engine', help='call the APIs through the client libraries, or their REST '
+                        'endpoints directly, with the requests of all projects on one pool of threads',
+                        choices=ENGINES, default='clients',
+                        required=False)
+    parser.add_argument('--engine-concurrency', help='requests in flight with the rest engine, '
+                        'for all projects',
+                        type=int, default=ENGINE_CONCURRENCY,
+                        required=False)
+    parser.add_argument('--retries', help='retries of an API call throttled with HTTP 429 or 503',
+                        type=int, default=RETRIES,
+                        required=False)
+    parser.add_argument('--retry-budget', help='seconds the projects of a run may spend in total '
+                        'waiting to retry API calls', type=int, default=RETRY_BUDGET,
+                        required=False)
+    return parser
+
+
+def inventory_targets(parser, args, **options):
+    """Return the config of each project and region to inventory, from the arguments
 
-    global config
-    config = {}
+    options are added to the config of every target.
+    """
+    config = dict(options)
     config['username'] = args.username
     config['password'] = args.password
     config['project'] = args.project
     config['auth_url'] = args.auth_url
     config['region_name'] = args.region_name
-    config['file'] = args.file
+    config['auth_concurrency'] = args.auth_concurrency
+    config['token_cache'] = args.token_cache
+    config['pool_size'] = args.pool_size
+    config['fetch_workers'] = args.fetch_workers
+    config['fetch_timeout'] = args.fetch_timeout
+    config['projection'] = not args.no_projection
+    config['deep_stacks'] = args.deep_stacks
+    config['engine'] = args.engine
+    config['engine_concurrency'] = args.engine_concurrency
+    config['retries'] = args.retries
+    config['retry_budget'] = args.retry_budget
+    config['retry'] = RetryPolicy(args.retries, args.retry_budget)
+    config['gzip'] = not args.no_gzip
+
+    if args.clouds_yaml:
+        targets = [dict(config, **cloud)
+                   for cloud in load_clouds(args.clouds_yaml, args.cloud and args.cloud.split(','))]
+        if not targets:
+            parser.error('no cloud found in %s' % args.clouds_yaml)
+    else:
+        projects = args.projects.split(',') if args.projects else [config['project']]
+        regions = args.regions.split(',') if args.regions else [config['region_name']]
+        targets = [dict(config, project=project, region_name=region)
+                   for project in projects for region in regions]
 
     missing = []
-    for arg in config.keys():
-        if arg != 'file' and config[arg] is None:
-            missing.append(arg)
+    for target in targets:
+        for arg in CREDENTIALS:
+            if target[arg] is None and arg not in missing:
+                missing.append(arg)
+
+    config['page_sizes'] = {}
+    for page_size in args.page_size:
+        service, _, size = page_size.partition('=')
+        if service not in PAGE_SIZES or not size.isdigit() or not int(size):
+            parser.error('invalid page size: %s' % page_size)
+        config['page_sizes'][service] = int(size)
+
+    for option in ('only', 'exclude'):
+        config[option] = None
+        if getattr(args, option):
+            config[option] = []
+            for name in getattr(args, option).split(','):
+                if name in Inventory.RESOURCES:
+                    config[option].append(name)
+                elif FETCH_RESOURCES.get(name):
+                    config[option].extend(FETCH_RESOURCES[name])
+                else:
+                    parser.error('unknown resource in --%s: %s' % (option, name))
+
+    config['filters'] = {}
+    for option in ('status', 'name', 'created_after', 'tag'):
+        for value in getattr(args, option):
+            resource, _, value = value.partition('=')
+            if option not in FILTERS.get(resource, ()) or not value:
+                parser.error('invalid filter: --%s %s=%s' % (option.replace('_', '-'), resource, value))
+            if option == 'name':
+                try:
+                    re.compile(value)
+                except re.error as e:
+                    parser.error('invalid regular expression %s: %s' % (value, e))
+            if option == 'created_after' and not re.match(r'^\d{4}-\d{2}-\d{2}', value):
+                parser.error('invalid date, expected YYYY-MM-DD: %s' % value)
+            config['filters'].setdefault(resource, {})[option] = value
+    if args.image_category:
+        config['filters'].setdefault('images', {})['category'] = args.image_category
+
+    config['cache'] = not args.no_cache
+    config['cache_ttls'] = {}
+    for cache_ttl in args.cache_ttl:
+        resource, _, ttl = cache_ttl.rpartition('=')
+        if (resource and resource not in CACHE_TTLS) or not ttl.isdigit():
+            parser.error('invalid cache TTL: %s' % cache_ttl)
+        for r in [resource] if resource else CACHE_TTLS:
+            config['cache_ttls'][r] = int(ttl)
 
     if missing:
         print 'please export or provide as parameters the following:'
         print missing
         sys.exit(0)
 
+    return [dict(config, **target) for target in targets]
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        return COMMANDS[sys.argv[1]](sys.argv[2:])
+
+    parser = inventory_parser(description=
+                              'Print resources from an OpenStack' \
+                              'project',
+                              epilog='commands: %s, see osinventory.py COMMAND -h'
+                              % ', '.join(sorted(COMMANDS))
+                              )
+    parser.add_argument('-f', '--file', help='save output to file',
+                        default=None,
+                        required=False)
+    parser.add_argument('--delta', help='refresh servers, volumes and images from the '
+                        'changes since the cached inventory, and report them',
+                        action='store_true', default=False,
+                        required=False)
+    parser.add_argument('--profile', help='print the time, payload and rows of each fetch '
+                        'and API operation, and the critical path of the fetches',
+                        action='store_true', default=False,
+                        required=False)
+    parser.add_argument('--profile-jsonl', help='append the profile of the API calls and fetches '
+                        'to this file, as JSON lines',
+                        default=None,
+                        required=False)
+    parser.add_argument('--record', help='append every API response to this fixture file, '
+                        'to be replayed by osfake.py (it contains the token)',
+                        default=None,
+                        required=False)
+    parser.add_argument('--output-format', help='table, or records of resources as JSON lines, '
+                        'CSV or msgpack', choices=['table'] + sorted(OUTPUT_WRITERS), default='table',
+                        required=False)
+    parser.add_argument('--stream-rows', help='write the tables of more rows than this line by line, '
+                        'sized from their first %d rows, instead of rendering them whole '
+                        '(0: stream every table)' % STREAM_SAMPLE,
+                        type=int, default=STREAM_ROWS,
+                        required=False)
+    parser.add_argument('-o', '--output', help='write the inventory to this file instead of '
+                        'the standard output',
+                        default=None,
+                        required=False)
+    parser.add_argument('--snapshot', help='save the inventory as a snapshot in this directory, '
+                        'to be compared by the diff command (default directory: %s)' % SNAPSHOT_DIR,
+                        nargs='?', const=SNAPSHOT_DIR, default=None,
+                        required=False)
+    parser.add_argument('--store', help='save the inventory in this SQLite store, to be queried '
+                        'by the query command (default store: %s)' % STORE_PATH,
+                        nargs='?', const=STORE_PATH, default=None,
+                        required=False)
+    args = parser.parse_args()
+
+    if args.delta and args.no_cache:
+        parser.error('--delta needs the cache, it cannot be used with --no-cache')
+    if args.file and args.output_format != 'table':
+        parser.error('-f only saves tables, use --output with --output-format %s' % args.output_format)
+
+    targets = inventory_targets(parser, args, file=args.file, delta=args.delta, profile=args.profile,
+                                profile_jsonl=args.profile_jsonl, record=args.record,
+                                stream_rows=args.stream_rows)
+
+    output = open(args.output, 'wb') if args.output else sys.stdout
+    writer = None
+    if args.output_format != 'table':
+        writer = OUTPUT_WRITERS[args.output_format](output)
+    # Messages go to stderr when records are written to stdout
+    log = sys.stderr if writer is not None and output is sys.stdout else sys.stdout
+    report = log if writer is not None else output
+
+    snapshot = None
+    if args.snapshot:
+        if not os.path.isdir(args.snapshot):
+            os.makedirs(args.snapshot)
+        snapshot_path = os.path.join(args.snapshot, time.strftime('%Y%m%dT%H%M%SZ.jsonl', time.gmtime()))
+        snapshot = SnapshotWriter(open(snapshot_path + '.tmp', 'w'))
+        snapshot.write(snapshot_scope(targets[0]))
+
     start_time = time.time()
-    print 'Getting Ressources, Please Wait......'
-    utility = OpenStackUtils(config)
-    utility.print_ressources()
-    print("--- %s seconds ---" % (time.time() - start_time))
+    print >>log, 'Getting Ressources, Please Wait......'
+    try:
+        if len(targets) == 1:
+            utility = OpenStackUtils(targets[0])
+            if writer is not None:
+                utility.write_records(writer)
+            else:
+                utility.print_ressources(output)
+                utility.print_deltas(output)
+            if snapshot is not None:
+                utility.write_records(snapshot)
+            utility.print_profile(report)
+            utility.save_token()
+            utilities = [utility]
+        else:
+            utilities = inventory_all(targets, args.workers, report, writer, snapshot)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if snapshot is not None:
+            snapshot.stream.close()
+    if snapshot is not None:
+        # Only complete snapshots are named as such
+        os.rename(snapshot_path + '.tmp', snapshot_path)
+        print >>log, "--- snapshot saved in %s ---" % snapshot_path
+    if args.store:
+        try:
+            store = InventoryStore(args.store)
+            try:
+                for utility in utilities:
+                    utility.store_inventory(store)
+            finally:
+                store.close()
+            print >>log, "--- inventory stored in %s ---" % args.store
+        except (sqlite3.Error, OSError) as e:
+            logging.error("Could not store the inventory in %s: %s" % (args.store, e))
+    print >>log, "--- %s seconds ---" % (time.time() - start_time)
+    server_lookups = sum(utility.server_lookups for utility in utilities)
+    if server_lookups:
+        print >>log, "--- %s extra server lookups ---" % server_lookups
+    retries = sum(utility.retries() for utility in utilities)
+    if retries:
+        print >>log, "--- %s API calls retried ---" % retries
+    stats = [utility.connection_stats() for utility in utilities]
+    print >>log, "--- %s HTTP connections opened, %s reused ---" % (sum(opened for opened, _ in stats),
+                                                                   sum(reused for _, reused in stats))
+
+
+COMMANDS = {'diff': diff_command,
+            'query': query_command,
+            'serve': serve_command}
 
 
 if __name__ == "__main__":